@@ -0,0 +1,376 @@
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import PlainTextResponse
+
+from models import AdmissionMetrics
+from profiling import stage
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> float:
+        """Take `cost` tokens; returns 0 on success, else seconds until they would be available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class InMemoryBackend:
+    """Process-local admission state: limits apply per worker process. For tests and single
+    process runs; `SharedBackend` implements the same four methods across workers."""
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: dict[str, TokenBucket] = {}
+        self._in_flight = 0
+
+    def take_token(self, client: str, rate: float, burst: float) -> float:
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                if len(self._buckets) >= self.MAX_BUCKETS:
+                    self._buckets.clear()  # forgetting idle clients only ever refills them
+                bucket = self._buckets[client] = TokenBucket(rate, burst)
+            return bucket.take()
+
+    def reserve_bytes(self, nbytes: int, limit: int) -> bool:
+        with self._lock:
+            # A request larger than the whole budget may still run, but only alone
+            if self._in_flight and self._in_flight + nbytes > limit:
+                return False
+            self._in_flight += nbytes
+            return True
+
+    def release_bytes(self, nbytes: int):
+        with self._lock:
+            self._in_flight -= nbytes
+
+    def in_flight_bytes(self) -> int:
+        return self._in_flight
+
+
+class SharedBackend:
+    """Admission state shared by every worker process on this host, in a SQLite file.
+
+    Token buckets and the bytes in flight live in the file, so the per-client rate and the
+    bytes cap hold across gunicorn workers. Reservations are recorded per pid, and those of
+    processes that died without releasing them are dropped. Every call is one short
+    transaction on a local file (WAL, no fsync).
+    """
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS bucket "
+                           "(client TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS inflight "
+                           "(pid INTEGER PRIMARY KEY, bytes INTEGER NOT NULL)")
+        # A row under our pid was left by an earlier process that had it
+        self._conn.execute("DELETE FROM inflight WHERE pid = ?", (self._pid,))
+
+    def take_token(self, client: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT tokens, updated FROM bucket WHERE client = ?", (client,)).fetchone()
+            if row is None:
+                tokens = burst
+                if conn.execute("SELECT COUNT(*) FROM bucket").fetchone()[0] >= self.MAX_BUCKETS:
+                    # Buckets that have refilled are indistinguishable from new ones
+                    conn.execute("DELETE FROM bucket WHERE updated < ?", (now - burst / rate,))
+            else:
+                tokens = min(burst, row[0] + max(0.0, now - row[1]) * rate)
+            wait = 0.0
+            if tokens >= 1.0:
+                tokens -= 1.0
+            else:
+                wait = (1.0 - tokens) / rate
+            conn.execute("INSERT OR REPLACE INTO bucket (client, tokens, updated) VALUES (?, ?, ?)",
+                         (client, tokens, now))
+            return wait
+
+    def reserve_bytes(self, nbytes: int, limit: int) -> bool:
+        with self._transaction() as conn:
+            in_flight = self._sum(conn)
+            if in_flight and in_flight + nbytes > limit:
+                if not self._drop_dead(conn):
+                    return False
+                in_flight = self._sum(conn)
+                if in_flight and in_flight + nbytes > limit:
+                    return False
+            conn.execute("INSERT INTO inflight (pid, bytes) VALUES (?, ?) "
+                         "ON CONFLICT (pid) DO UPDATE SET bytes = bytes + excluded.bytes",
+                         (self._pid, nbytes))
+            return True
+
+    def release_bytes(self, nbytes: int):
+        with self._transaction() as conn:
+            conn.execute("UPDATE inflight SET bytes = bytes - ? WHERE pid = ?", (nbytes, self._pid))
+
+    def in_flight_bytes(self) -> int:
+        with self._lock:
+            return self._sum(self._conn)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _sum(conn) -> int:
+        return conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM inflight").fetchone()[0]
+
+    def _drop_dead(self, conn) -> bool:
+        """Forget reservations of worker processes that no longer exist"""
+        dead = [pid for (pid,) in conn.execute("SELECT pid FROM inflight WHERE bytes != 0")
+                if pid != self._pid and not _alive(pid)]
+        for pid in dead:
+            logger.warning("admission: dropping bytes reserved by dead process %d", pid)
+            conn.execute("DELETE FROM inflight WHERE pid = ?", (pid,))
+        return bool(dead)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+
+class Throttled(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Per-client token-bucket rate limits plus a global in-flight bytes cap.
+
+    Requests that don't fit under the bytes cap wait in per-client FIFO queues that are
+    served round-robin, so one client with hundreds of queued uploads can't starve the
+    others. Anything still waiting after `max_wait` seconds is rejected with 429. The queues
+    are per process; with a `SharedBackend` the limits are shared and each worker re-polls
+    it for bytes freed by the others.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or InMemoryBackend()
+        self.rate = 0.0  # requests per second per client, 0 disables
+        self.burst = 0.0
+        self.max_inflight_bytes = 0  # 0 disables
+        self.max_wait = 30.0
+        self.poll_interval = 0.25  # re-check the backend for bytes freed by other processes
+        self._waiters: "OrderedDict[str, deque[tuple[int, asyncio.Future]]]" = OrderedDict()
+        self._admitted = 0
+        self._queued = 0
+        self._throttled = {"rate": 0, "bytes": 0}
+
+    def configure(self, rate: float = 0.0, burst: float = 0.0, max_inflight_bytes: int = 0,
+                  max_wait: float = 30.0, backend=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_wait = max_wait
+        if backend is not None:
+            self.backend = backend
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 or self.max_inflight_bytes > 0
+
+    async def acquire(self, client: str, nbytes: int) -> int:
+        """Wait for admission; returns the number of bytes reserved (pass it to release)"""
+        if self.rate > 0:
+            deadline = time.monotonic() + self.max_wait
+            while (wait := self.backend.take_token(client, self.rate, self.burst)) > 0:
+                if time.monotonic() + wait > deadline:
+                    self._throttled["rate"] += 1
+                    raise Throttled("rate", wait)
+                await asyncio.sleep(wait)
+
+        if self.max_inflight_bytes <= 0 or nbytes <= 0:
+            self._admitted += 1
+            return 0
+
+        nbytes = min(nbytes, self.max_inflight_bytes)
+        if not self._waiters and self.backend.reserve_bytes(nbytes, self.max_inflight_bytes):
+            self._admitted += 1
+            return nbytes
+
+        # Fair queueing: park in this client's queue until the round-robin dispatcher admits us
+        future = asyncio.get_running_loop().create_future()
+        entry = (nbytes, future)
+        self._waiters.setdefault(client, deque()).append(entry)
+        self._queued += 1
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while not future.done():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait({future}, timeout=min(self.poll_interval, remaining))
+                self._dispatch()
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                self.release(nbytes)  # admitted at the last moment
+            else:
+                self._remove_waiter(client, entry)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._throttled["bytes"] += 1
+            raise Throttled("bytes", self.poll_interval * 4)
+        self._admitted += 1
+        return nbytes
+
+    def release(self, nbytes: int):
+        if nbytes:
+            self.backend.release_bytes(nbytes)
+            self._dispatch()
+
+    def metrics(self) -> AdmissionMetrics:
+        return AdmissionMetrics(
+            enabled=self.enabled,
+            in_flight_bytes=self.backend.in_flight_bytes(),
+            queued_now=sum(len(q) for q in self._waiters.values()),
+            admitted=self._admitted,
+            queued=self._queued,
+            throttled_rate=self._throttled["rate"],
+            throttled_bytes=self._throttled["bytes"],
+        )
+
+    def _dispatch(self):
+        """Admit queued requests round-robin across clients while the bytes budget allows"""
+        while self._waiters:
+            client, queue = next(iter(self._waiters.items()))
+            nbytes, future = queue[0]
+            if not self.backend.reserve_bytes(nbytes, self.max_inflight_bytes):
+                return
+            queue.popleft()
+            future.set_result(None)
+            # Move this client to the back of the rotation
+            del self._waiters[client]
+            if queue:
+                self._waiters[client] = queue
+
+    def _remove_waiter(self, client: str, entry):
+        queue = self._waiters.get(client)
+        if queue is None:
+            return
+        try:
+            queue.remove(entry)
+        except ValueError:
+            pass
+        if not queue:
+            del self._waiters[client]
+
+
+# Global instance
+admission = AdmissionController()
+
+
+def client_key(scope) -> str:
+    """API key if the client sent one, else its address"""
+    for name, value in scope.get("headers", []):
+        if name == b"x-api-key":
+            return "key:" + value.decode("latin-1")
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware so uploads are admitted before their body is read.
+
+    `routes` maps a path prefix to a cost function `(scope) -> bytes` (may be sync/blocking;
+    it runs in the threadpool). Reserved bytes are held until the response is fully sent.
+    """
+
+    def __init__(self, app, controller: AdmissionController, routes: dict[str, Callable[[dict], int]]):
+        self.app = app
+        self.controller = controller
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        cost = self._match(scope)
+        if cost is None or not self.controller.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            with stage("admission"):
+                nbytes = await run_in_threadpool(cost, scope) if self.controller.max_inflight_bytes > 0 else 0
+                reserved = await self.controller.acquire(client_key(scope), nbytes)
+        except Throttled as e:
+            response = PlainTextResponse(
+                f"Too many requests ({e.reason}), retry later",
+                status_code=429,
+                headers={"Retry-After": str(max(1, round(e.retry_after)))}
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(reserved)
+
+    def _match(self, scope) -> Optional[Callable[[dict], int]]:
+        if scope["type"] != "http":
+            return None
+        path = scope["path"]
+        for prefix, cost in self.routes.items():
+            if path == prefix or path.startswith(prefix + "/"):
+                return cost
+        return None
+
+
+def content_length(scope) -> int:
+    """Cost of an upload: its declared body size"""
+    for name, value in scope.get("headers", []):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return 0
+    return 0
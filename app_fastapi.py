@@ -1,35 +1,144 @@
 import os
+import hmac
+import asyncio
+import tempfile
+from datetime import timedelta
 import unicodedata
 from dotenv import load_dotenv
 import boto3
 import uuid
-import io
 from datetime import datetime
 from contextlib import asynccontextmanager
 from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
-from fastapi.templating import Jinja2Templates
-from werkzeug.utils import secure_filename
-from pydantic import BaseModel, MySQLDsn
+from functools import cache
+from fastapi import FastAPI, UploadFile, File, Form, Request, Depends, Query, HTTPException
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, Response, PlainTextResponse, JSONResponse
+from botocore.exceptions import ClientError
 from sqlmodel import Session, select
 
-from db import get_db, db_manager
-from models import FileInfo, FileListResponse, Upload
+from db import get_db, db_manager, build_db_uri
+from models import FileInfo, FileListResponse, StatsResponse, QueryResponse, SearchRequest, SearchResponse, CompactResponse, ResumableCreateRequest, ResumableUploadResponse, SlowRequestsResponse, Upload, UploadQueueMetrics, AdmissionMetrics, ScrubMetrics, STATUS_UPLOADED, STATUS_PENDING, NOT_IN_S3
+from upload_queue import upload_queue
+from storage_policy import storage_policy, storage_tierer, touch, accepts_encoding
+from admission import admission, AdmissionMiddleware, SharedBackend, content_length
+from presign import presigned_urls, content_disposition
+from processing import processor
+from deletion import delete_upload
+import columnar
+from vector_index import vector_index, make_embedder, index_document
+from previews import preview_renderer, generate_preview, preview_key, CACHE_CONTROL
+import stats
+from stats import stats_recomputer
+from profiling import profiler, ProfilingMiddleware, stage, format_folded
+from scrubber import scrubber
+from leader import leader_lock
+from resumable import resumable_uploads, ResumableUpload, UploadConflict, STATE_COMPLETE
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
 
 
 load_dotenv()
 
-db_host = os.getenv("RMI_MYSQL_HOST")
-db_port = os.getenv("RMI_MYSQL_PORT")
-db_user = os.getenv("RMI_MYSQL_USER")
-db_password = os.getenv("RMI_MYSQL_PASSWORD")
-db_name = os.getenv("RMI_MYSQL_DB_NAME")
 bucket_name = os.getenv("RMI_S3_BUCKET_NAME")
 
 # ====== Configuration ======
 ALLOWED_EXTENSIONS = {'pdf', 'xls', 'xlsx'}
 
+# Singleton background jobs (stats recompute, processing backfill, resumable-upload janitor,
+# storage tiering, scrubbing) run in one process per host: the one holding RMI_LEADER_LOCK.
+# Set RMI_BACKGROUND_JOBS=0 on all but one host when running several hosts.
+BACKGROUND_JOBS = os.getenv("RMI_BACKGROUND_JOBS", "1") == "1"
+LEADER_LOCK = os.getenv("RMI_LEADER_LOCK", os.path.join(tempfile.gettempdir(), "rmi-background-jobs.lock"))
+
+# Create missing tables on startup. serve.py turns this off and runs `migrate` once
+# before forking workers instead.
+AUTO_MIGRATE = os.getenv("RMI_AUTO_MIGRATE", "1") == "1"
+
+# Async upload mode: /upload stages the body locally, inserts a pending row and returns;
+# a background worker pool pushes staged files to S3 (see upload_queue.py)
+ASYNC_UPLOADS = os.getenv("RMI_ASYNC_UPLOADS", "0") == "1"
+UPLOAD_STAGING_DIR = os.getenv("RMI_UPLOAD_STAGING_DIR", "staging")
+UPLOAD_WORKERS = int(os.getenv("RMI_UPLOAD_WORKERS", "4"))
+UPLOAD_MAX_RETRIES = int(os.getenv("RMI_UPLOAD_MAX_RETRIES", "5"))
+
+# Storage policy: zstd-compress these file types in S3 (e.g. "xls"), and move objects
+# not downloaded for N days to cheaper storage classes (e.g. "STANDARD_IA:30,GLACIER_IR:180")
+COMPRESS_TYPES = {t.strip().lower() for t in os.getenv("RMI_COMPRESS_TYPES", "").split(",") if t.strip()}
+COMPRESS_LEVEL = int(os.getenv("RMI_COMPRESS_LEVEL", "10"))
+TIER_RULES = os.getenv("RMI_TIER_RULES", "")
+TIER_INTERVAL = float(os.getenv("RMI_TIER_INTERVAL", "3600"))
+
+# Admission control for /upload, /download and /delete: per-client (X-API-Key or IP) request
+# rate, and a global cap on bytes in flight; over-budget requests queue fairly, then get 429.
+# RMI_ADMISSION_STATE is a SQLite file that shares the limits between the worker processes
+# of this host (serve.py sets it); empty = limits are per process
+RATE_LIMIT = float(os.getenv("RMI_RATE_LIMIT", "0"))  # requests/sec per client, 0 = off
+RATE_BURST = float(os.getenv("RMI_RATE_BURST", "0"))
+MAX_INFLIGHT_BYTES = int(os.getenv("RMI_MAX_INFLIGHT_BYTES", "0"))  # 0 = off
+ADMISSION_MAX_WAIT = float(os.getenv("RMI_ADMISSION_MAX_WAIT", "30"))
+ADMISSION_STATE = os.getenv("RMI_ADMISSION_STATE", "")
+
+# Downloads: "proxy" streams S3 -> app -> client, "redirect" answers 302 to a presigned S3 URL,
+# "auto" redirects only files of at least RMI_REDIRECT_MIN_BYTES (small files stay proxied)
+DOWNLOAD_MODE = os.getenv("RMI_DOWNLOAD_MODE", "proxy")
+REDIRECT_MIN_BYTES = int(os.getenv("RMI_REDIRECT_MIN_BYTES", str(1024 * 1024)))
+PRESIGN_EXPIRES = int(os.getenv("RMI_PRESIGN_EXPIRES", "300"))  # seconds
+
+# Post-upload processing (processing.py): derive artifacts such as Parquet copies of
+# spreadsheets, then mark the file processed. Backfill picks up files uploaded earlier.
+# Files processing for longer than RMI_PROCESSING_TIMEOUT seconds (worker died) are requeued.
+PROCESSING = os.getenv("RMI_PROCESSING", "0") == "1"
+PROCESSING_WORKERS = int(os.getenv("RMI_PROCESSING_WORKERS", "2"))
+PROCESSING_BACKFILL = os.getenv("RMI_PROCESSING_BACKFILL", "0") == "1"
+PROCESSING_TIMEOUT = float(os.getenv("RMI_PROCESSING_TIMEOUT", "3600"))
+
+# Chunk/embedding store for retrieval over processed documents (vector_index.py);
+# RMI_EMBEDDER is "hashing[:dim]" (deterministic, no model) or "st:<sentence-transformers model>".
+# Every RMI_VECTOR_COMPACT_INTERVAL seconds the index is rewritten without deleted files' chunks
+# once they make up RMI_VECTOR_COMPACT_MIN_DELETED of it (also POST /admin/vector-index/compact)
+VECTOR_INDEX_DIR = os.getenv("RMI_VECTOR_INDEX_DIR", "")  # empty = disabled
+EMBEDDER = os.getenv("RMI_EMBEDDER", "hashing")
+VECTOR_COMPACT_INTERVAL = float(os.getenv("RMI_VECTOR_COMPACT_INTERVAL", "86400"))  # 0 = never
+VECTOR_COMPACT_MIN_DELETED = float(os.getenv("RMI_VECTOR_COMPACT_MIN_DELETED", "0.2"))
+
+# PDF first-page thumbnails and spreadsheet head previews (previews.py), rendered in
+# a process pool of this many processes while processing
+PREVIEW_PROCESSES = int(os.getenv("RMI_PREVIEW_PROCESSES", "2"))
+
+processor.register("columnar", columnar.convert_workbook)
+processor.register("vector_index", index_document)  # no-op unless the index is open
+processor.register("preview", generate_preview)
+
+# /stats reads a summary table maintained on every upload/delete; a periodic full
+# recompute corrects drift (0 = never)
+STATS_RECOMPUTE_INTERVAL = float(os.getenv("RMI_STATS_RECOMPUTE_INTERVAL", "3600"))
+
+# Integrity scrubber (scrubber.py): checks size/ETag of every object with head_object at
+# RMI_SCRUB_RATE rows/s and sha256-hashes a random RMI_SCRUB_HASH_FRACTION of them (1 = all)
+# reading at most RMI_SCRUB_BANDWIDTH bytes/s; a new pass starts every RMI_SCRUB_INTERVAL seconds
+SCRUB = os.getenv("RMI_SCRUB", "0") == "1"
+SCRUB_RATE = float(os.getenv("RMI_SCRUB_RATE", "10"))
+SCRUB_HASH_FRACTION = float(os.getenv("RMI_SCRUB_HASH_FRACTION", "0.01"))
+SCRUB_BANDWIDTH = int(os.getenv("RMI_SCRUB_BANDWIDTH", str(8 * 1024 * 1024)))
+SCRUB_WORKERS = int(os.getenv("RMI_SCRUB_WORKERS", "4"))
+SCRUB_INTERVAL = float(os.getenv("RMI_SCRUB_INTERVAL", "86400"))
+
+# Resumable uploads (resumable.py): /uploads endpoints backed by S3 multipart uploads;
+# uploads not written to for RMI_RESUMABLE_TTL_DAYS are aborted. Chunks are buffered in a
+# temp file (in memory up to RMI_RESUMABLE_SPOOL_BYTES) and may be at most RMI_RESUMABLE_MAX_CHUNK.
+RESUMABLE_TTL_DAYS = float(os.getenv("RMI_RESUMABLE_TTL_DAYS", "7"))
+RESUMABLE_SPOOL_BYTES = int(os.getenv("RMI_RESUMABLE_SPOOL_BYTES", str(8 * 1024 * 1024)))
+RESUMABLE_MAX_CHUNK = int(os.getenv("RMI_RESUMABLE_MAX_CHUNK", str(256 * 1024 * 1024)))
+
+# Diagnostics: requests slower than RMI_SLOW_REQUEST_MS (0 = off) are kept with their stage
+# timings and SQL in a ring buffer of RMI_SLOW_REQUEST_BUFFER entries. /admin/* endpoints
+# (sampling profiler, slow requests) need the X-Admin-Token header; no token = disabled.
+# Both are per process: under serve.py they only cover the worker that answers the admin call.
+ADMIN_TOKEN = os.getenv("RMI_ADMIN_TOKEN", "")
+SLOW_REQUEST_MS = float(os.getenv("RMI_SLOW_REQUEST_MS", "1000"))
+SLOW_REQUEST_BUFFER = int(os.getenv("RMI_SLOW_REQUEST_BUFFER", "100"))
+PROFILE_MAX_SECONDS = 300
+
 # boto3 will automatically look for Access Key and Secret in the following places:
 # 1. Environment variables
 # 2. AWS credentials file: ~/.aws/credentials
@@ -40,30 +149,84 @@ s3 = boto3.client('s3')
 
 
 
+def start_background_jobs():
+    """Jobs that must run in exactly one process (see leader.py)"""
+    if PROCESSING:
+        processor.start_reclaimer()
+        if PROCESSING_BACKFILL:
+            processor.submit_backfill()
+    resumable_uploads.start(ttl=timedelta(days=RESUMABLE_TTL_DAYS))
+    if STATS_RECOMPUTE_INTERVAL > 0:
+        stats_recomputer.start(interval=STATS_RECOMPUTE_INTERVAL)
+    if SCRUB:
+        scrubber.start(
+            s3,
+            bucket_name,
+            rate=SCRUB_RATE,
+            bandwidth=SCRUB_BANDWIDTH,
+            hash_fraction=SCRUB_HASH_FRACTION,
+            workers=SCRUB_WORKERS,
+            interval=SCRUB_INTERVAL
+        )
+    if TIER_RULES:
+        storage_tierer.start(s3, bucket_name, storage_tierer.parse_rules(TIER_RULES), interval=TIER_INTERVAL)
+    if vector_index.enabled and VECTOR_COMPACT_INTERVAL > 0:
+        vector_index.start_compactor(interval=VECTOR_COMPACT_INTERVAL, min_deleted=VECTOR_COMPACT_MIN_DELETED)
+
 # Add lifespan event management: load once before the app starts
 # use connection params from RMI_MYSQL_*
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    db_uri = MySQLDsn.build(
-        scheme="mysql+pymysql", # MySQL driver
-        username=db_user,
-        password=db_password,
-        host=db_host,
-        port=3306,
-        path=db_name  # Important: Include '/' before DB name
+    db_manager.init_db(build_db_uri(), create_schema=AUTO_MIGRATE)
+    if VECTOR_INDEX_DIR:
+        vector_index.open(VECTOR_INDEX_DIR, make_embedder(EMBEDDER))
+    if PROCESSING:
+        preview_renderer.configure(PREVIEW_PROCESSES)
+        processor.start(s3, bucket_name, workers=PROCESSING_WORKERS,
+                        timeout=timedelta(seconds=PROCESSING_TIMEOUT))
+    if ASYNC_UPLOADS:
+        upload_queue.start(
+            s3,
+            bucket_name,
+            staging_dir=UPLOAD_STAGING_DIR,
+            workers=UPLOAD_WORKERS,
+            max_retries=UPLOAD_MAX_RETRIES
+        )
+    storage_policy.configure(COMPRESS_TYPES, level=COMPRESS_LEVEL)
+    presigned_urls.configure(s3, bucket_name, expires=PRESIGN_EXPIRES)
+    resumable_uploads.configure(s3, bucket_name)
+    admission.configure(
+        rate=RATE_LIMIT,
+        burst=RATE_BURST,
+        max_inflight_bytes=MAX_INFLIGHT_BYTES,
+        max_wait=ADMISSION_MAX_WAIT,
+        backend=SharedBackend(ADMISSION_STATE) if ADMISSION_STATE else None
     )
-    
-    db_manager.init_db(str(db_uri))
+    profiler.configure(SLOW_REQUEST_MS, capacity=SLOW_REQUEST_BUFFER)
+    if BACKGROUND_JOBS:
+        leader_lock.start(LEADER_LOCK, start_background_jobs)
     yield
-    # Shutdown cleanup if needed
+    # Shutdown: staged uploads not yet in S3 are picked up again on next start
+    leader_lock.stop()
+    upload_queue.stop()
+    processor.stop()
+    preview_renderer.stop()
+    storage_tierer.stop()
+    scrubber.stop()
+    resumable_uploads.stop()
+    stats_recomputer.stop()
+    vector_index.stop()
 
 app = FastAPI(lifespan=lifespan, 
               title="S3 File Manager", 
               description="Upload, download, and manage files with AWS S3")
 
-# Setup templates
-templates = Jinja2Templates(directory="templates")
+# Setup templates (loaded on first use; jinja2 is only needed for the HTML page)
+@cache
+def get_templates():
+    from fastapi.templating import Jinja2Templates
+    return Jinja2Templates(directory="templates")
 
 
 # ====== Helper functions ======
@@ -77,11 +240,59 @@ def calculate_file_size(file: UploadFile) -> int:
     file.file.seek(0)  # Reset to beginning for upload
     return file_size
 
+def download_size(scope) -> int:
+    """Admission cost of a download: the bytes we will stream ourselves from metadata
+    (0 if unknown, not in S3, or answered with a redirect)"""
+    s3_key = scope["path"][len("/download/"):]
+    with db_manager.get_session() as session:
+        upload_record = session.exec(select(Upload).where(Upload.s3_key == s3_key)).first()
+    if upload_record is None or upload_record.status in NOT_IN_S3:
+        return 0
+    accept_encoding = Headers(scope=scope).get("accept-encoding")
+    client_decodes = bool(upload_record.content_encoding) and accepts_encoding(accept_encoding, upload_record.content_encoding)
+    if redirects(upload_record, client_decodes):
+        return 0
+    return (upload_record.stored_size or upload_record.size) if client_decodes else upload_record.size
+
+def should_redirect(stored_size: int) -> bool:
+    """Download policy: redirect to a presigned URL, or proxy the bytes ourselves"""
+    if DOWNLOAD_MODE == "redirect":
+        return True
+    return DOWNLOAD_MODE == "auto" and stored_size >= REDIRECT_MIN_BYTES
+
+def redirects(upload_record: Upload, client_decodes: bool) -> bool:
+    """Whether /download answers with a presigned URL. Compressed files the client can't
+    decode still have to be proxied so we can decompress them."""
+    return (should_redirect(upload_record.stored_size or upload_record.size)
+            and (not upload_record.content_encoding or client_decodes))
+
+# ====== Admission control ======
+# ASGI middleware rather than a dependency so /upload is throttled before its body is read
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission,
+    routes={
+        "/upload": content_length,
+        "/uploads": content_length,  # resumable chunks
+        "/download": download_size,
+        "/delete": lambda scope: 0,  # rate limit only
+    }
+)
+
+# Added last = outermost, so traced request times include admission queueing
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404)
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 # ====== Routes ======
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request, message: Optional[str] = None, message_type: Optional[str] = None):
     """Render the main page"""
-    return templates.TemplateResponse("index.html", {
+    return get_templates().TemplateResponse("index.html", {
         "request": request,
         "message": message,
         "message_type": message_type
@@ -92,28 +303,43 @@ async def list_files(session: Session = Depends(get_db)):
     """List all files from database metadata"""
     try:
         statement = select(Upload)
-        uploads = session.exec(statement).all()
+        with stage("db_query"):
+            uploads = session.exec(statement).all()
         files = []
-        for upload in uploads:
-            files.append(FileInfo(
-                id=upload.id,
-                key=upload.s3_key,
-                size=round(upload.size / 1024, 2),
-                date_added=upload.date_added.isoformat(),
-                sourcename=upload.source_filename,
-                filename=upload.filename,
-                author=upload.author,
-                publication_date=upload.publication_date.isoformat() if upload.publication_date else None,
-                language=upload.language,
-                file_type=upload.file_type,
-                status=upload.status
-            ))
+        with stage("serialize"):
+            for upload in uploads:
+                files.append(FileInfo(
+                    id=upload.id,
+                    key=upload.s3_key,
+                    size=round(upload.size / 1024, 2),
+                    date_added=upload.date_added.isoformat(),
+                    sourcename=upload.source_filename,
+                    filename=upload.filename,
+                    author=upload.author,
+                    publication_date=upload.publication_date.isoformat() if upload.publication_date else None,
+                    language=upload.language,
+                    file_type=upload.file_type,
+                    status=upload.status
+                ))
 
         return FileListResponse(success=True, files=files)
     except Exception as e:
         return FileListResponse(success=False, error=str(e))
 
 
+@app.get("/stats", response_model=StatsResponse)
+async def get_stats(group_by: str = "language,file_type,status,month", session: Session = Depends(get_db)):
+    """File counts and total size grouped by any of language, file_type, status, month"""
+    columns = [c.strip() for c in group_by.split(",") if c.strip()]
+    invalid = [c for c in columns if c not in stats.GROUP_COLUMNS]
+    if invalid:
+        return StatsResponse(success=False, error=f"Invalid group_by: {', '.join(invalid)}")
+    try:
+        return StatsResponse(success=True, group_by=columns, groups=stats.query(session, columns))
+    except Exception as e:
+        return StatsResponse(success=False, error=str(e))
+
+
 # 1. Request arrives → FastAPI sees Depends(get_db)
 # 2. get_db() called → Gets session from connection pool  
 # 3. yield session → Session passed to route function
@@ -166,32 +392,66 @@ async def upload_file(
             file_type=file_type,
             source_filename=source_filename,
             pages=0,
-            status=0,  # 0: uploaded not processed, 1: processed
+            status=STATUS_UPLOADED,  # 0: uploaded not processed, 1: processed
             s3_key=file_s3_key
             # date_added is auto-generated by Python
         )
-        
+
+        # Compress if the storage policy says so; Upload.size stays the original size
+        # (zstd over the whole file: off the event loop)
+        with stage("prepare_body"):
+            body, content_encoding, stored_size = await run_in_threadpool(
+                storage_policy.prepare, file.file, file_type, file_size
+            )
+        metadata.content_encoding = content_encoding
+        metadata.stored_size = stored_size
+
+        extra_args = {
+            'Metadata': {
+                'id': file_id,
+            },
+            'ContentType': file.content_type or 'application/octet-stream'
+        }
+        if content_encoding:
+            extra_args['ContentEncoding'] = content_encoding
+
+        if upload_queue.enabled:
+            # Async mode: stage body locally -> commit pending row -> hand off to workers
+            # copy + fsync of the staged body: off the event loop
+            await run_in_threadpool(
+                upload_queue.stage, body, file_id, file_s3_key, extra_args['ContentType'], content_encoding
+            )
+            metadata.status = STATUS_PENDING
+            try:
+                session.add(metadata)
+                stats.apply(session, metadata)
+                session.commit()
+            except Exception:
+                upload_queue.discard(file_id)
+                raise
+            upload_queue.enqueue(file_id)
+            return RedirectResponse(url=f"/?message=File {file_s3_key} queued for upload&message_type=success", status_code=303)
+
         # print(metadata.model_dump())
         # PHASE 1: Prepare database transaction (don't commit yet) for file metadata
         session.add(metadata)
+        stats.apply(session, metadata)  # summary table row, same transaction
         session.flush()  # Validates but doesn't commit
 
         try:
             # PHASE 2: Upload to S3
-            s3.upload_fileobj(
-                file.file, 
-                bucket_name, 
-                file_s3_key, 
-                ExtraArgs={
-                    'Metadata': {
-                        'id': file_id,
-                    },
-                    'ContentType': file.content_type or 'application/octet-stream'
-                }
-            )
+            with stage("s3_upload"):
+                s3.upload_fileobj(
+                    body, 
+                    bucket_name, 
+                    file_s3_key, 
+                    ExtraArgs=extra_args
+                )
 
             # Both operations are successful -> commit DB transaction
-            session.commit()
+            with stage("db_commit"):
+                session.commit()
+            processor.submit(file_id)
         
             return RedirectResponse(url=f"/?message=File {file_s3_key} uploaded successfully&message_type=success", status_code=303)
         
@@ -206,58 +466,338 @@ async def upload_file(
     
 
 
+# ====== Resumable uploads ======
+# 1. POST /uploads with a client-generated upload_id -> offset 0 (or the current offset on retry)
+# 2. PUT /uploads/{upload_id}?offset=N with the raw bytes of the next chunk (>= 5 MiB but the last)
+#    409 + Upload-Offset header if N isn't the committed offset; HEAD tells where to resume
+# 3. POST /uploads/{upload_id}/complete -> the Upload id and s3_key, the same on every retry
+def resumable_response(record: ResumableUpload) -> JSONResponse:
+    body = ResumableUploadResponse(
+        success=True,
+        upload_id=record.id,
+        offset=record.offset,
+        length=record.length,
+        complete=record.state == STATE_COMPLETE,
+        id=record.file_id,
+        s3_key=record.s3_key
+    )
+    return JSONResponse(body.model_dump(mode="json"), headers=offset_headers(record.offset, record.length))
+
+def offset_headers(offset: int, length: Optional[int] = None) -> dict:
+    headers = {"Upload-Offset": str(offset), "Cache-Control": "no-store"}
+    if length is not None:
+        headers["Upload-Length"] = str(length)
+    return headers
+
+def resumable_error(message: str, status_code: int, offset: Optional[int] = None) -> JSONResponse:
+    return JSONResponse(
+        ResumableUploadResponse(success=False, offset=offset or 0, error=message).model_dump(mode="json"),
+        status_code=status_code,
+        headers=offset_headers(offset) if offset is not None else None
+    )
+
+@app.post("/uploads", response_model=ResumableUploadResponse)
+def create_resumable_upload(body: ResumableCreateRequest):
+    """Start (or look up) a resumable upload"""
+    if not allowed_file(body.filename):
+        return resumable_error("Invalid file type (allowed: pdf, xls, xlsx)", 400)
+    try:
+        record = resumable_uploads.create(
+            body.upload_id,
+            body.filename,
+            body.length,
+            body.content_type,
+            filename=body.title,
+            author=body.authors,
+            language=body.language,
+            publication_date=body.publication_date
+        )
+    except ValueError as e:
+        return resumable_error(str(e), 400)
+    except UploadConflict as e:
+        return resumable_error(str(e), 409)
+    return resumable_response(record)
+
+@app.head("/uploads/{upload_id}")
+def resumable_upload_offset(upload_id: str):
+    """Committed offset in the Upload-Offset header"""
+    record = resumable_uploads.get(upload_id)
+    if record is None:
+        return Response(status_code=404)
+    return Response(status_code=200, headers=offset_headers(record.offset, record.length))
+
+@app.get("/uploads/{upload_id}", response_model=ResumableUploadResponse)
+def resumable_upload_status(upload_id: str):
+    record = resumable_uploads.get(upload_id)
+    if record is None:
+        return resumable_error(f"No upload {upload_id}", 404)
+    return resumable_response(record)
+
+@app.put("/uploads/{upload_id}", response_model=ResumableUploadResponse)
+async def write_resumable_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """Append the request body at `offset`; only a fully received chunk is committed"""
+    declared = content_length(request.scope)
+    if declared > RESUMABLE_MAX_CHUNK:
+        return resumable_error(f"Chunks may be at most {RESUMABLE_MAX_CHUNK} bytes", 413)
+
+    with tempfile.SpooledTemporaryFile(max_size=RESUMABLE_SPOOL_BYTES) as chunk:
+        size = 0
+        async for data in request.stream():
+            size += len(data)
+            if size > RESUMABLE_MAX_CHUNK:
+                return resumable_error(f"Chunks may be at most {RESUMABLE_MAX_CHUNK} bytes", 413)
+            await run_in_threadpool(chunk.write, data)
+        if declared and size != declared:
+            # connection dropped mid-chunk: nothing is committed, the client resends from offset
+            return resumable_error(f"Received {size} of {declared} bytes", 400, offset)
+        chunk.seek(0)
+        try:
+            with stage("s3_upload_part"):
+                record = await run_in_threadpool(
+                    resumable_uploads.write_chunk, upload_id, offset, chunk, size,
+                    request.headers.get("content-md5")
+                )
+        except KeyError:
+            return resumable_error(f"No upload {upload_id}", 404)
+        except ValueError as e:
+            return resumable_error(str(e), 400)
+        except UploadConflict as e:
+            return resumable_error(str(e), 409, e.offset)
+    return resumable_response(record)
+
+@app.post("/uploads/{upload_id}/complete", response_model=ResumableUploadResponse)
+def complete_resumable_upload(upload_id: str):
+    """Assemble the parts into uuid/filename and create the Upload row (idempotent)"""
+    try:
+        record, upload, created = resumable_uploads.complete(upload_id)
+    except KeyError:
+        return resumable_error(f"No upload {upload_id}", 404)
+    except UploadConflict as e:
+        return resumable_error(str(e), 409, e.offset)
+    if created:
+        processor.submit(upload.id)
+    return resumable_response(record)
+
+@app.delete("/uploads/{upload_id}")
+def abort_resumable_upload(upload_id: str):
+    """Abandon an unfinished upload and free its stored parts"""
+    return Response(status_code=204 if resumable_uploads.abort(upload_id) else 404)
+
+
 # Note: s3_key is formated as uuid/filename
 # BUT fastapi can't directly take s3_key as parameter as it will segment by /
 # Solution: use s3_key:path to tell fastapi to treat uuid/filename as a single parameter
 @app.get("/download/{s3_key:path}")
-async def download_file(s3_key: str):
+async def download_file(s3_key: str, request: Request, session: Session = Depends(get_db)):
     """Download a file from S3"""
     try:
+        upload_record = session.exec(select(Upload).where(Upload.s3_key == s3_key)).first()
+        if upload_record and upload_record.status in NOT_IN_S3:
+            problem = "is not in S3 yet" if upload_record.status == STATUS_PENDING else "failed to upload to S3"
+            return RedirectResponse(url=f"/?message=File {s3_key} {problem}&message_type=error", status_code=303)
+        content_encoding = upload_record.content_encoding if upload_record else None
+        client_decodes = bool(content_encoding) and accepts_encoding(request.headers.get("accept-encoding"), content_encoding)
+
+        # Original filename from metadata (falls back to s3_key for objects without a row)
+        source_filename = upload_record.source_filename if upload_record else s3_key.split('/')[-1]
+
+        # Record the access for storage tiering (at most one write per hour per file)
+        if upload_record and touch(upload_record):
+            session.add(upload_record)
+            session.commit()
+
+        # Large files: let the client fetch straight from S3
+        if upload_record and redirects(upload_record, client_decodes):
+            url = presigned_urls.url(s3_key, source_filename, content_encoding)
+            return RedirectResponse(url=url, status_code=302)
+
         # Get file from S3
-        response = s3.get_object(Bucket=bucket_name, Key=s3_key)
-        file_content = response['Body'].read()
-        
-        # Get original filename from s3_key
-        source_filename = s3_key.split('/')[-1]
-        
-        # Create streaming response
-        def generate():
-            yield file_content
-        
+        with stage("s3_get"):
+            response = s3.get_object(Bucket=bucket_name, Key=s3_key)
+        headers = {"Content-Disposition": content_disposition(source_filename)}
+
+        # Stream the body in chunks instead of reading the whole object into memory
+        chunks = response['Body'].iter_chunks(chunk_size=1024 * 1024)
+        if content_encoding:
+            if client_decodes:
+                headers["Content-Encoding"] = content_encoding  # client decodes
+            else:
+                chunks = storage_policy.decompress(chunks, content_encoding)
+
         return StreamingResponse(
-            generate(),
+            chunks,
             media_type='application/octet-stream',
-            headers={"Content-Disposition": f"attachment; filename={source_filename}"}
+            headers=headers
         )
     except Exception as e:
         return RedirectResponse(url=f"/?message=ERROR DOWNLOADING FILE: {str(e)}&message_type=error", status_code=303)
 
+# Plain def: pyarrow decoding and ranged S3 reads run in the threadpool, off the event loop
+@app.get("/query/{s3_key:path}", response_model=QueryResponse)
+def query_spreadsheet(
+    s3_key: str,
+    sheet: str = "0",
+    columns: str = "",
+    where: list[str] = Query([]),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=10000),
+    session: Session = Depends(get_db)
+):
+    """Read selected columns/rows of a converted xls/xlsx sheet, e.g. ?columns=a,b&where=a>=10"""
+    upload_record = session.exec(select(Upload).where(Upload.s3_key == s3_key)).first()
+    if upload_record is None:
+        return QueryResponse(success=False, error=f"No metadata for {s3_key}")
+    if upload_record.file_type not in columnar.SPREADSHEET_TYPES:
+        return QueryResponse(success=False, error="Only xls/xlsx files can be queried")
+    try:
+        manifest = columnar.load_manifest(s3, bucket_name, upload_record.id)
+    except s3.exceptions.NoSuchKey:
+        return QueryResponse(success=False, error="File has not been converted yet")
+
+    # sheet by index or by name
+    match = [m for m in manifest if str(m["index"]) == sheet or m["name"] == sheet]
+    if not match:
+        return QueryResponse(success=False, error=f"No sheet {sheet}; sheets: {[m['name'] for m in manifest]}")
+
+    try:
+        result = columnar.query_sheet(
+            s3, bucket_name, match[0]["key"],
+            columns=[c.strip() for c in columns.split(",") if c.strip()] or None,
+            filters=where,
+            offset=offset,
+            limit=limit
+        )
+    except ValueError as e:
+        return QueryResponse(success=False, error=str(e))
+
+    return QueryResponse(
+        success=True,
+        sheet=match[0]["name"],
+        next_offset=offset + len(result["rows"]) if len(result["rows"]) == limit else None,
+        **result
+    )
+
+# Plain def: the S3 read runs in the threadpool
+@app.get("/preview/{s3_key:path}")
+def preview_file(s3_key: str, request: Request, session: Session = Depends(get_db)):
+    """First-page thumbnail (PDF) or head-of-sheet JSON (xls/xlsx), cacheable forever"""
+    upload_record = session.exec(select(Upload).where(Upload.s3_key == s3_key)).first()
+    key = preview_key(upload_record) if upload_record else None
+    if key is None:
+        return Response(status_code=404)
+
+    params = {'Bucket': bucket_name, 'Key': key}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        params['IfNoneMatch'] = if_none_match
+    try:
+        response = s3.get_object(**params)
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        if code == '304':  # client copy is current: no body
+            return Response(status_code=304, headers={"ETag": if_none_match, "Cache-Control": CACHE_CONTROL})
+        if code in ('NoSuchKey', '404'):
+            return Response(status_code=404)  # not generated yet
+        raise
+
+    return Response(
+        response['Body'].read(),  # previews are small
+        media_type=response['ContentType'],
+        headers={"ETag": response['ETag'], "Cache-Control": CACHE_CONTROL}
+    )
+
+# Plain def: embedding and the block-wise matrix products run in the threadpool
+@app.post("/search", response_model=SearchResponse)
+def search(body: SearchRequest, session: Session = Depends(get_db)):
+    """Top-k chunks by cosine similarity for a batch of queries"""
+    if not vector_index.enabled:
+        return SearchResponse(success=False, error="Vector index is not enabled")
+
+    results = vector_index.search(body.queries, k=body.k)
+
+    # Attach s3 keys with one query for all hits
+    ids = {hit["upload_id"] for hits in results for hit in hits}
+    keys = dict(session.exec(select(Upload.id, Upload.s3_key).where(Upload.id.in_(ids))).all()) if ids else {}
+    # Hits of files deleted since their chunks were indexed are dropped
+    return SearchResponse(success=True, results=[
+        [{**hit, "s3_key": keys[hit["upload_id"]]} for hit in hits if hit["upload_id"] in keys]
+        for hits in results
+    ])
+
 @app.get("/delete/{s3_key:path}")
 async def delete_file(s3_key: str, session: Session = Depends(get_db)):
     """Delete a file from S3 and remove metadata from lightsail mysql"""
 
     try:
-        # Phase 1: Delete metadata from mysql
         statement = select(Upload).where(Upload.s3_key == s3_key)
         upload_record = session.exec(statement).first()
         if upload_record:
-            session.delete(upload_record)
-            session.flush()
-        
-        # Phase 2: Delete file from s3
-        s3.delete_object(Bucket=bucket_name, Key=s3_key)
-
-        # commit Mysql changes after s3 deletion success
-        if upload_record:
-            session.commit()
+            # row, S3 object, staged body, derived artifacts, index chunks (deletion.py)
+            delete_upload(session, s3, bucket_name, upload_record)
             return RedirectResponse(url=f"/?message=File {s3_key} deleted successfully&message_type=success", status_code=303)
         else:
+            s3.delete_object(Bucket=bucket_name, Key=s3_key)
             return RedirectResponse(url=f"/?message=File {s3_key} deleted from S3 (no metadata found)&message_type=success", status_code=303)
     
     except Exception as e:
         session.rollback()
         return RedirectResponse(url=f"/?message=ERROR DELETING FILE: {str(e)}&message_type=error", status_code=303)
 
+@app.get("/upload-queue/metrics", response_model=UploadQueueMetrics)
+async def upload_queue_metrics():
+    """Depth and lag of the background upload queue"""
+    return upload_queue.metrics()
+
+@app.get("/scrub/metrics", response_model=ScrubMetrics)
+async def scrub_metrics():
+    """Integrity scrubber progress and problems found (details in Upload.scrub_status)"""
+    return scrubber.metrics()
+
+@app.get("/admission/metrics", response_model=AdmissionMetrics)
+async def admission_metrics():
+    """In-flight bytes, queueing and throttling counters of the admission layer"""
+    return admission.metrics()
+
+# ====== Admin ======
+@app.get("/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profile(seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS)):
+    """Sample every thread for N seconds; folded stacks for flamegraph.pl / speedscope"""
+    stacks = await asyncio.to_thread(profiler.sample, seconds)
+    if stacks is None:
+        return PlainTextResponse("A profile is already running", status_code=409)
+    return PlainTextResponse(format_folded(stacks))
+
+@app.post("/admin/profile/arm", response_model=SlowRequestsResponse, dependencies=[Depends(require_admin)])
+async def arm_profiler(seconds: float = Query(60, gt=0, le=PROFILE_MAX_SECONDS), threshold_ms: Optional[float] = Query(None, gt=0)):
+    """Sample in the background for N seconds; slow requests in that window get their stacks"""
+    if threshold_ms is not None:
+        profiler.configure(threshold_ms, capacity=SLOW_REQUEST_BUFFER)
+    if not profiler.enabled:
+        return SlowRequestsResponse(success=False, error="Slow-request capture is off (set threshold_ms)")
+    if not profiler.arm(seconds):
+        return SlowRequestsResponse(success=False, error="A profile is already running")
+    return SlowRequestsResponse(success=True, threshold_ms=profiler.slow_ms, profiling=True)
+
+@app.get("/admin/slow-requests", response_model=SlowRequestsResponse, dependencies=[Depends(require_admin)])
+async def slow_requests(limit: int = Query(20, ge=1, le=1000)):
+    """Most recent requests over the latency threshold, with stage timings and SQL"""
+    return SlowRequestsResponse(
+        success=True,
+        threshold_ms=profiler.slow_ms,
+        profiling=profiler.armed,
+        requests=profiler.slow_requests(limit)
+    )
+
+@app.post("/admin/vector-index/compact", response_model=CompactResponse, dependencies=[Depends(require_admin)])
+def compact_vector_index():
+    """Rewrite the vector index without the chunks of deleted files"""
+    if not vector_index.enabled:
+        return CompactResponse(success=False, error="Vector index is not enabled")
+    compacted = vector_index.compact()
+    index_stats = vector_index.stats()
+    return CompactResponse(success=True, compacted=compacted, rows=index_stats["rows"],
+                           live_rows=index_stats["live_rows"])
+
 # ====== Health Check ======
 @app.get("/health")
 async def health_check():
@@ -1,201 +1,289 @@
 import streamlit as st
 import boto3
-import io
+import os
 import uuid
-from datetime import datetime
-from werkzeug.utils import secure_filename
+import unicodedata
+from typing import Optional
+from dotenv import load_dotenv
+from sqlmodel import select
 import pandas as pd
 
+from db import db_manager, build_db_uri
+from models import Upload, STATUS_UPLOADED, NOT_IN_S3
+from presign import presigned_urls
+from deletion import delete_upload
+from vector_index import vector_index, make_embedder
+import stats
+
+load_dotenv()
+
 # ====== Configuration ======
-AWS_S3_BUCKET = 'rag-file-storage-bucket'  # Same as Flask app
+AWS_S3_BUCKET = os.getenv("RMI_S3_BUCKET_NAME", 'rag-file-storage-bucket')  # Same as FastAPI app
 ALLOWED_EXTENSIONS = {'pdf', 'xls', 'xlsx'}
+PAGE_SIZES = [100, 500, 1000, 5000]
+PAGE_CACHE_TTL = 300  # seconds; mutations from this app clear the cache right away
+MAX_DOWNLOAD_LINKS = 20  # presigned URLs are only generated for selected rows
+STATUS_LABELS = {0: 'Uploaded', 1: 'Processed', 2: 'Queued', 3: 'Upload failed', 4: 'Processing'}
 
-# Initialize S3 client
+# Initialize S3 client and DB connection pool once per server process
 @st.cache_resource
 def init_s3_client():
-    return boto3.client('s3')
+    client = boto3.client('s3')
+    presigned_urls.configure(client, AWS_S3_BUCKET, expires=int(os.getenv("RMI_PRESIGN_EXPIRES", "300")))
+    return client
+
+@st.cache_resource
+def init_db():
+    db_manager.init_db(build_db_uri())
+    return db_manager
+
+@st.cache_resource
+def init_vector_index():
+    # Same directory and embedder as the FastAPI app, so deletes tombstone their chunks
+    index_dir = os.getenv("RMI_VECTOR_INDEX_DIR", "")
+    if index_dir:
+        vector_index.open(index_dir, make_embedder(os.getenv("RMI_EMBEDDER", "hashing")))
+    return vector_index
 
 s3 = init_s3_client()
+init_db()
+init_vector_index()
 
 # ====== Helper functions ======
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def list_s3_files():
-    """Fetch files from S3 bucket"""
-    try:
-        response = s3.list_objects_v2(Bucket=AWS_S3_BUCKET)
-        files = []
-
-        if 'Contents' in response:
-            for item in response['Contents']:
-                files.append({
-                    'Filename': item['Key'],
-                    'Size (KB)': round(item['Size'] / 1024, 2),
-                    'Last Modified': item['LastModified'].strftime('%Y-%m-%d %H:%M:%S'),
-                    'Key': item['Key']  # For internal use
-                })
-        
-        return files
-    except Exception as e:
-        st.error(f"Error listing files: {str(e)}")
-        return []
-
-def upload_to_s3(file, filename):
-    """Upload file to S3"""
-    try:
-        s3.upload_fileobj(
-            file, 
-            AWS_S3_BUCKET, 
-            filename,
-            ExtraArgs={
-                'Metadata': {
-                    'id': str(uuid.uuid4()),
-                },
-                'ContentType': file.type if hasattr(file, 'type') else 'application/octet-stream'
-            }
+@st.cache_data(ttl=PAGE_CACHE_TTL, show_spinner=False)
+def load_page(after_id: str, page_size: int) -> pd.DataFrame:
+    """One page of file metadata from the Upload table, keyset-paginated by id"""
+    with db_manager.get_session() as session:
+        statement = (
+            select(Upload)
+            .where(Upload.id > after_id)
+            .order_by(Upload.id)
+            .limit(page_size)
         )
-        return True, None
-    except Exception as e:
-        return False, str(e)
-
-def download_from_s3(filename):
-    """Download file from S3"""
-    try:
-        file_obj = io.BytesIO()
-        s3.download_fileobj(AWS_S3_BUCKET, filename, file_obj)
-        file_obj.seek(0)
-        return file_obj, None
-    except Exception as e:
-        return None, str(e)
-
-def delete_from_s3(filename):
-    """Delete file from S3"""
-    try:
-        s3.delete_object(Bucket=AWS_S3_BUCKET, Key=filename)
-        return True, None
-    except Exception as e:
-        return False, str(e)
+        uploads = session.exec(statement).all()
+    return pd.DataFrame([{
+        'File': upload.source_filename,
+        'Title': upload.filename,
+        'Author': upload.author,
+        'Language': upload.language.upper(),
+        'Type': upload.file_type.upper(),
+        'Size (KB)': round(upload.size / 1024, 2),
+        'Added': upload.date_added,
+        'Status': STATUS_LABELS.get(upload.status, 'Unknown'),
+        'id': upload.id,
+        'key': upload.s3_key,
+        'status_code': upload.status,
+        'content_encoding': upload.content_encoding,
+    } for upload in uploads])
 
-# ====== Streamlit App ======
-def main():
-    st.set_page_config(
-        page_title="S3 File Manager",
-        page_icon="📁",
-        layout="wide"
+@st.cache_data(ttl=PAGE_CACHE_TTL, show_spinner=False)
+def count_files() -> int:
+    """Total from the stats summary table instead of COUNT(*) over Upload"""
+    with db_manager.get_session() as session:
+        return sum(group["files"] for group in stats.query(session, ["status"]))
+
+def invalidate_listing():
+    load_page.clear()
+    count_files.clear()
+
+def upload_file(file, filename: str, author: str, language: str) -> tuple[Optional[str], Optional[str]]:
+    """Upload to S3 as uuid/filename with an Upload row, like the FastAPI app"""
+    source_filename = unicodedata.normalize("NFC", os.path.basename(file.name))
+    file_id = str(uuid.uuid4().hex)
+    file_s3_key = f"{file_id}/{source_filename}"
+    metadata = Upload(
+        id=file_id,
+        filename=filename.strip(),
+        author=author.strip(),
+        language=language,
+        size=file.size,
+        file_type=source_filename.rsplit('.', 1)[-1].lower(),
+        source_filename=source_filename,
+        pages=0,
+        status=STATUS_UPLOADED,  # not processed until the FastAPI app starts with RMI_PROCESSING_BACKFILL=1
+        s3_key=file_s3_key
     )
-    
-    st.title("📁 S3 File Manager")
-    st.markdown("---")
-    
-    # File Upload Section
+    with db_manager.get_session() as session:
+        try:
+            session.add(metadata)
+            stats.apply(session, metadata)
+            session.flush()
+            s3.upload_fileobj(
+                file,
+                AWS_S3_BUCKET,
+                file_s3_key,
+                ExtraArgs={
+                    'Metadata': {
+                        'id': file_id,
+                    },
+                    'ContentType': file.type or 'application/octet-stream'
+                }
+            )
+            session.commit()
+            return file_s3_key, None
+        except Exception as e:
+            session.rollback()
+            return None, str(e)
+
+def delete_file(file_id: str) -> Optional[str]:
+    """Delete a file like the FastAPI app does (deletion.py); returns an error or None"""
+    with db_manager.get_session() as session:
+        try:
+            upload = session.get(Upload, file_id)
+            if upload is None:
+                return None  # already deleted
+            delete_upload(session, s3, AWS_S3_BUCKET, upload)
+        except Exception as e:
+            session.rollback()
+            return str(e)
+    return None
+
+# ====== Streamlit App ======
+def upload_section():
     st.subheader("Upload File")
-    
+
     uploaded_file = st.file_uploader(
-        "Choose a file", 
+        "Choose a file",
         type=['pdf', 'xls', 'xlsx'],
         help="Allowed file types: PDF, XLS, XLSX"
     )
-    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        title = st.text_input("Title")
+    with col2:
+        author = st.text_input("Author(s)")
+    with col3:
+        language = st.selectbox("Language", ["en", "zh"])
+
     if uploaded_file is not None:
         if st.button("Upload", type="primary"):
             if allowed_file(uploaded_file.name):
-                filename = secure_filename(uploaded_file.name)
-                
-                with st.spinner(f"Uploading {filename}..."):
-                    success, error = upload_to_s3(uploaded_file, filename)
-                    
-                if success:
-                    st.success(f"File {filename} uploaded successfully!")
-                    st.rerun()  # Refresh to show new file in list
+                with st.spinner(f"Uploading {uploaded_file.name}..."):
+                    s3_key, error = upload_file(uploaded_file, title, author, language)
+
+                if s3_key:
+                    invalidate_listing()
+                    st.success(f"File {s3_key} uploaded successfully!")
                 else:
                     st.error(f"Error uploading file: {error}")
             else:
                 st.error("Invalid file type. Allowed: PDF, XLS, XLSX")
-    
+
+def pagination_controls(page_size: int, page: pd.DataFrame):
+    # cursors[i] is the id after which page i starts
+    cursors = st.session_state.setdefault("cursors", [""])
+    col1, col2, col3 = st.columns([1, 1, 6])
+    with col1:
+        if st.button("◀ Previous", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if st.button("Next ▶", disabled=len(page) < page_size):
+            cursors.append(page['id'].iloc[-1])
+            st.rerun()
+    with col3:
+        st.caption(f"Page {len(cursors)} · {count_files()} files")
+
+def actions_section(selected: pd.DataFrame):
+    st.markdown("### File Actions")
+    if selected.empty:
+        st.caption("Select rows in the table to download or delete them.")
+        return
+
+    # Presigned URLs: the browser downloads straight from S3, nothing is loaded in here
+    st.markdown("**Download**")
+    for row in selected.head(MAX_DOWNLOAD_LINKS).itertuples():
+        if row.status_code in NOT_IN_S3:
+            st.caption(f"{row.File}: not in S3 yet")
+            continue
+        if pd.notna(row.content_encoding):
+            # the object is compressed and browsers can't be relied on to decode it; the
+            # FastAPI /download route decompresses on the fly
+            st.caption(f"{row.File}: stored {row.content_encoding}-compressed, download it from the web app")
+            continue
+        url = presigned_urls.url(row.key, row.File)
+        st.link_button(f"⬇️ {row.File}", url)
+    if len(selected) > MAX_DOWNLOAD_LINKS:
+        st.caption(f"Showing links for the first {MAX_DOWNLOAD_LINKS} selected files.")
+
+    st.markdown("**Delete**")
+    if st.button(f"🗑️ Delete {len(selected)} selected", type="secondary"):
+        st.session_state["confirm_delete"] = list(selected['id'])
+
+    pending = st.session_state.get("confirm_delete")
+    if pending:
+        st.warning(f"Are you sure you want to delete {len(pending)} file(s)?")
+        col_yes, col_no = st.columns(2)
+        with col_yes:
+            if st.button("Yes, Delete", type="primary"):
+                errors = []
+                with st.spinner("Deleting..."):
+                    for file_id in pending:
+                        error = delete_file(file_id)
+                        if error:
+                            errors.append(f"{file_id}: {error}")
+                st.session_state["confirm_delete"] = None
+                invalidate_listing()
+                if errors:
+                    st.error("Error deleting files: " + "; ".join(errors))
+                else:
+                    st.rerun()
+        with col_no:
+            if st.button("Cancel"):
+                st.session_state["confirm_delete"] = None
+                st.rerun()
+
+def main():
+    st.set_page_config(
+        page_title="S3 File Manager",
+        page_icon="📁",
+        layout="wide"
+    )
+
+    st.title("📁 S3 File Manager")
     st.markdown("---")
-    
+
+    upload_section()
+
+    st.markdown("---")
+
     # File List Section
-    st.subheader("Files in S3 Bucket")
-    
-    # Refresh button
+    st.subheader("Files")
+
     col1, col2 = st.columns([1, 6])
     with col1:
         if st.button("🔄 Refresh"):
-            st.rerun()
-    
-    # Get file list
-    files = list_s3_files()
-    
-    if not files:
-        st.info("No files found in the bucket.")
-    else:
-        # Create DataFrame for display
-        df = pd.DataFrame(files)
-        display_df = df[['Filename', 'Size (KB)', 'Last Modified']].copy()
-        
-        st.dataframe(
-            display_df,
-            use_container_width=True,
-            hide_index=True
-        )
-        
-        st.markdown("### File Actions")
-        
-        # Action buttons for each file
-        for i, file_info in enumerate(files):
-            filename = file_info['Key']
-            col1, col2, col3, col4 = st.columns([3, 1, 1, 3])
-            
-            with col1:
-                st.text(filename)
-            
-            with col2:
-                # Download button
-                if st.button("⬇️ Download", key=f"download_{i}"):
-                    with st.spinner(f"Downloading {filename}..."):
-                        file_obj, error = download_from_s3(filename)
-                        
-                    if file_obj:
-                        st.download_button(
-                            label=f"Click to save {filename}",
-                            data=file_obj,
-                            file_name=filename,
-                            mime='application/octet-stream',
-                            key=f"save_{i}"
-                        )
-                    else:
-                        st.error(f"Error downloading file: {error}")
-            
-            with col3:
-                # Delete button
-                if st.button("🗑️ Delete", key=f"delete_{i}", type="secondary"):
-                    # Confirmation dialog using session state
-                    st.session_state[f"confirm_delete_{i}"] = True
-            
-            # Handle delete confirmation
-            if st.session_state.get(f"confirm_delete_{i}", False):
-                st.warning(f"Are you sure you want to delete {filename}?")
-                col_yes, col_no = st.columns(2)
-                
-                with col_yes:
-                    if st.button("Yes, Delete", key=f"confirm_yes_{i}", type="primary"):
-                        with st.spinner(f"Deleting {filename}..."):
-                            success, error = delete_from_s3(filename)
-                        
-                        if success:
-                            st.success(f"File {filename} deleted successfully!")
-                            st.session_state[f"confirm_delete_{i}"] = False
-                            st.rerun()
-                        else:
-                            st.error(f"Error deleting file: {error}")
-                
-                with col_no:
-                    if st.button("Cancel", key=f"confirm_no_{i}"):
-                        st.session_state[f"confirm_delete_{i}"] = False
-                        st.rerun()
-            
-            st.markdown("---")
+            invalidate_listing()
+    with col2:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, on_change=lambda: st.session_state.update(cursors=[""]))
+
+    cursors = st.session_state.setdefault("cursors", [""])
+    page = load_page(cursors[-1], page_size)
+
+    if page.empty:
+        st.info("No files found.")
+        if len(cursors) > 1:
+            pagination_controls(page_size, page)
+        return
+
+    pagination_controls(page_size, page)
+
+    # st.dataframe only draws the visible rows, so thousand-row pages stay responsive;
+    # row selection replaces per-row buttons
+    event = st.dataframe(
+        page[['File', 'Title', 'Author', 'Language', 'Type', 'Size (KB)', 'Added', 'Status']],
+        use_container_width=True,
+        hide_index=True,
+        height=500,
+        on_select="rerun",
+        selection_mode="multi-row",
+        key=f"files_{cursors[-1]}_{page_size}"
+    )
+
+    actions_section(page.iloc[event.selection.rows])
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,104 @@
+"""Startup-time and cores-scaling benchmark for serve.py.
+
+    python bench_startup.py [--workers 1,2,4] [--seconds 5] [--clients 16]
+
+Reports the import time of app_fastapi, the time from launching serve.py until /health
+answers, and /health throughput per worker count. No database or S3 access is needed:
+the migrate step and background jobs are switched off.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import http.client
+from concurrent.futures import ProcessPoolExecutor
+
+PORT = 8765
+ENV = {
+    **os.environ,
+    "RMI_BIND": f"127.0.0.1:{PORT}",
+    "RMI_SKIP_MIGRATE": "1",
+    "RMI_STATS_RECOMPUTE_INTERVAL": "0",
+    "RMI_MYSQL_HOST": os.getenv("RMI_MYSQL_HOST", "localhost"),
+    "RMI_MYSQL_USER": os.getenv("RMI_MYSQL_USER", "bench"),
+    "RMI_MYSQL_PASSWORD": os.getenv("RMI_MYSQL_PASSWORD", "bench"),
+    "RMI_MYSQL_DB_NAME": os.getenv("RMI_MYSQL_DB_NAME", "bench"),
+    "AWS_DEFAULT_REGION": os.getenv("AWS_DEFAULT_REGION", "us-east-1"),
+}
+
+
+def import_time(runs: int = 5) -> float:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import app_fastapi"], env=ENV, check=True)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def wait_healthy(timeout: float = 60.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.02)
+    return False
+
+
+def hammer(seconds: float) -> int:
+    """One client process: keep-alive GET /health in a loop, returns requests completed"""
+    conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=5)
+    done = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        conn.request("GET", "/health")
+        conn.getresponse().read()
+        done += 1
+    return done
+
+
+def run(workers: int, seconds: float, clients: int) -> tuple[float, float]:
+    env = {**ENV, "RMI_WORKERS": str(workers)}
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "serve.py"], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_healthy():
+            raise RuntimeError("server did not become healthy")
+        startup = time.perf_counter() - start
+        time.sleep(1.0)  # let every worker finish booting before measuring throughput
+        with ProcessPoolExecutor(clients) as pool:
+            total = sum(pool.map(hammer, [seconds] * clients))
+        return startup, total / seconds
+    finally:
+        server.terminate()
+        server.wait(30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    cores = os.cpu_count() or 1
+    default_workers = ",".join(str(n) for n in sorted({1, 2, 4, cores}) if n <= cores)
+    parser.add_argument("--workers", default=default_workers)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--clients", type=int, default=max(4, cores * 2))
+    args = parser.parse_args()
+
+    print(f"import app_fastapi: {import_time() * 1000:.0f} ms (median of 5)")
+    print(f"{'workers':>7} {'startup (s)':>12} {'req/s':>10} {'scaling':>8}")
+    baseline = None
+    for workers in (int(n) for n in args.workers.split(",")):
+        startup, rps = run(workers, args.seconds, args.clients)
+        baseline = baseline or rps
+        print(f"{workers:>7} {startup:>12.2f} {rps:>10.0f} {rps / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
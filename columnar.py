@@ -0,0 +1,246 @@
+import io
+import json
+import operator
+from typing import Any, Optional
+
+from processing import derived_prefix
+from models import Upload
+
+SPREADSHEET_TYPES = {"xls", "xlsx"}
+ROW_GROUP_SIZE = 10_000  # smaller row groups = finer-grained range reads and pruning
+
+FILTER_OPS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+
+def sheets_prefix(file_id: str) -> str:
+    return derived_prefix(file_id) + "sheets/"
+
+
+# ====== Conversion (processing handler) ======
+def convert_workbook(s3_client, bucket: str, upload: Upload, local_path: str):
+    """Write each sheet of an xls/xlsx upload as Parquet under <id>/_derived/sheets/"""
+    if upload.file_type not in SPREADSHEET_TYPES:
+        return
+
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sheets = pd.read_excel(local_path, sheet_name=None)
+    manifest = []
+    for index, (name, df) in enumerate(sheets.items()):
+        table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, row_group_size=ROW_GROUP_SIZE, compression="zstd",
+                       write_statistics=True)
+        key = f"{sheets_prefix(upload.id)}{index}.parquet"
+        s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue(),
+                             ContentType="application/vnd.apache.parquet")
+        manifest.append({"index": index, "name": str(name), "key": key,
+                         "rows": table.num_rows, "columns": table.column_names})
+
+    s3_client.put_object(Bucket=bucket, Key=f"{sheets_prefix(upload.id)}manifest.json",
+                         Body=json.dumps(manifest).encode(), ContentType="application/json")
+
+
+def _arrow_safe(df):
+    """Unique string column names; mixed-type object columns (common in xls) as strings"""
+    import pandas as pd
+
+    names, seen = [], {}
+    for column in df.columns:
+        name = str(column)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    df = df.copy()
+    df.columns = names
+    for name in names:
+        column = df[name]
+        if column.dtype == object and pd.api.types.infer_dtype(column, skipna=True) not in ("string", "empty"):
+            df[name] = column.map(lambda v: None if pd.isna(v) else str(v))
+    return df
+
+
+# ====== Query ======
+class S3RangeFile(io.RawIOBase):
+    """Seekable read-only file over an S3 object; every read is a ranged GET, so Parquet
+    readers only fetch the footer and the column chunks they need"""
+
+    def __init__(self, s3_client, bucket: str, key: str):
+        self._s3 = s3_client
+        self._bucket = bucket
+        self._key = key
+        self._size = s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self._pos = 0
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = self._size + offset
+        return self._pos
+
+    def size(self) -> int:
+        return self._size
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self._size or len(buffer) == 0:
+            return 0
+        end = min(self._pos + len(buffer), self._size) - 1
+        body = self._s3.get_object(Bucket=self._bucket, Key=self._key,
+                                   Range=f"bytes={self._pos}-{end}")["Body"].read()
+        buffer[:len(body)] = body
+        self._pos += len(body)
+        self.bytes_read += len(body)
+        return len(body)
+
+
+def parse_filter(expression: str) -> tuple[str, str, str]:
+    """"amount>=100" -> ("amount", ">=", "100")"""
+    for op in sorted(FILTER_OPS, key=len, reverse=True):
+        column, sep, value = expression.partition(op)
+        if sep and column.strip():
+            return column.strip(), op, value.strip()
+    raise ValueError(f"Invalid filter: {expression} (expected <column><op><value>, op one of {', '.join(FILTER_OPS)})")
+
+
+def _coerce(value: str, arrow_type) -> Any:
+    import pyarrow as pa
+
+    if pa.types.is_integer(arrow_type):
+        return int(value)
+    if pa.types.is_floating(arrow_type):
+        return float(value)
+    if pa.types.is_boolean(arrow_type):
+        return value.lower() in ("1", "true", "yes")
+    if pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type):
+        from datetime import datetime
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _may_match(statistics, op: str, value: Any) -> bool:
+    """Row-group pruning from min/max statistics; True when unknown"""
+    if statistics is None or not statistics.has_min_max:
+        return True
+    low, high = statistics.min, statistics.max
+    try:
+        if op == "==":
+            return low <= value <= high
+        if op == "!=":
+            return not (low == high == value)
+        if op in (">", ">="):
+            return FILTER_OPS[op](high, value)
+        return FILTER_OPS[op](low, value)
+    except TypeError:
+        return True
+
+
+def query_sheet(s3_client, bucket: str, key: str, columns: Optional[list[str]] = None,
+                filters: Optional[list[str]] = None, offset: int = 0, limit: int = 100) -> dict:
+    """Read only the requested columns/rows of a converted sheet, skipping row groups whose
+    statistics rule out the filters"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    source = S3RangeFile(s3_client, bucket, key)
+    parquet = pq.ParquetFile(source)
+    schema = parquet.schema_arrow
+
+    selected = columns or schema.names
+    unknown = [c for c in selected if c not in schema.names]
+    predicates = []
+    for expression in filters or []:
+        column, op, raw = parse_filter(expression)
+        if column not in schema.names:
+            unknown.append(column)
+            continue
+        predicates.append((column, op, _coerce(raw, schema.field(column).type)))
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+    read_columns = list(dict.fromkeys(selected + [c for c, _, _ in predicates]))
+    metadata = parquet.metadata
+    column_index = {name: i for i, name in enumerate(schema.names)}
+
+    batches = []
+    skipped = 0  # matching rows skipped so far towards `offset`
+    collected = 0
+    row_start = 0
+    for group in range(metadata.num_row_groups):
+        group_meta = metadata.row_group(group)
+        group_rows = group_meta.num_rows
+        group_start, row_start = row_start, row_start + group_rows
+
+        if not predicates and group_start + group_rows <= offset:
+            skipped += group_rows  # whole group before the requested range: no read at all
+            continue
+        if any(not _may_match(group_meta.column(column_index[c]).statistics, op, v) for c, op, v in predicates):
+            continue
+
+        table = parquet.read_row_group(group, columns=read_columns)
+        if predicates:
+            mask = None
+            for column, op, value in predicates:
+                condition = _compare(pc, table[column], op, value)
+                mask = condition if mask is None else pc.and_(mask, condition)
+            table = table.filter(pc.fill_null(mask, False))
+
+        if skipped < offset:
+            drop = min(offset - skipped, table.num_rows)
+            table = table.slice(drop)
+            skipped += drop
+        if table.num_rows:
+            table = table.slice(0, limit - collected).select(selected)
+            batches.append(table)
+            collected += table.num_rows
+        if collected >= limit:
+            break
+
+    result = pa.concat_tables(batches) if batches else schema.empty_table().select(selected)
+    return {
+        "columns": selected,
+        "rows": result.to_pylist(),
+        "total_rows": metadata.num_rows,
+        "bytes_read": source.bytes_read,
+    }
+
+
+def _compare(pc, array, op: str, value: Any):
+    return {
+        "==": pc.equal,
+        "!=": pc.not_equal,
+        ">=": pc.greater_equal,
+        "<=": pc.less_equal,
+        ">": pc.greater,
+        "<": pc.less,
+    }[op](array, value)
+
+
+def load_manifest(s3_client, bucket: str, file_id: str) -> list[dict]:
+    body = s3_client.get_object(Bucket=bucket, Key=f"{sheets_prefix(file_id)}manifest.json")["Body"].read()
+    return json.loads(body)
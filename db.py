@@ -3,8 +3,11 @@ from dotenv import load_dotenv
 from datetime import datetime
 from urllib.parse import quote_plus
 from sqlmodel import SQLModel, Field, create_engine, Session, select
+from sqlalchemy import inspect, text
 from pydantic import MySQLDsn
 
+from profiling import stage, tracing
+
 load_dotenv()
 
 ## NOT USED!!!
@@ -23,13 +26,31 @@ load_dotenv()
 #     path=db_name  # Important: Include '/' before DB name
 # )
 
+def build_db_uri() -> str:
+    """MySQL URI from the RMI_MYSQL_* environment variables"""
+    return str(MySQLDsn.build(
+        scheme="mysql+pymysql", # MySQL driver
+        username=os.getenv("RMI_MYSQL_USER"),
+        password=os.getenv("RMI_MYSQL_PASSWORD"),
+        host=os.getenv("RMI_MYSQL_HOST"),
+        port=int(os.getenv("RMI_MYSQL_PORT") or 3306),
+        path=os.getenv("RMI_MYSQL_DB_NAME")  # Important: Include '/' before DB name
+    ))
+
 class DatabaseManager:
     def __init__(self):
         self.engine = None
     
-    def init_db(self, db_uri: str):
+    def init_db(self, db_uri: str, create_schema: bool = True):
         self.engine = create_engine(db_uri, pool_size=20) # at most 20 db connections
+        if create_schema:
+            self.create_schema()
+
+    def create_schema(self):
+        # Every table model must be imported before this runs
         SQLModel.metadata.create_all(self.engine)
+        add_missing_columns(self.engine)
+        widen_columns(self.engine)
 
     def get_session(self):
         return Session(self.engine)
@@ -37,9 +58,89 @@ class DatabaseManager:
 # Global instance
 db_manager = DatabaseManager()
 
+def migrate(db_uri: str):
+    """Explicit schema step for production (serve.py), run once instead of in every worker"""
+    engine = create_engine(db_uri)
+    try:
+        SQLModel.metadata.create_all(engine)
+        add_missing_columns(engine)
+        widen_columns(engine)
+    finally:
+        engine.dispose()
+
+def add_missing_columns(engine) -> list[str]:
+    """create_all only creates missing tables: add the columns models gained since a table
+    was created (ALTER TABLE ... ADD COLUMN). Returns the columns added as "table.column"."""
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    added = []
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                # existing rows get the model's scalar default (e.g. storage_class 'STANDARD')
+                if not column.nullable and _scalar_default(column) is None:
+                    raise RuntimeError(f"Can't add NOT NULL column {table.name}.{column.name} without a default")
+                conn.execute(text(f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN "
+                                  f"{_column_ddl(column, engine.dialect)}"))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+def widen_columns(engine) -> list[str]:
+    """Grow VARCHAR columns whose model max_length went up since the table was created
+    (MySQL only: SQLite doesn't enforce lengths). Returns the columns changed."""
+    if engine.dialect.name != "mysql":
+        return []
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    widened = []
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            lengths = {column["name"]: getattr(column["type"], "length", None)
+                       for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                length = getattr(column.type, "length", None)
+                current = lengths.get(column.name)
+                if length is None or current is None or current >= length:
+                    continue
+                conn.execute(text(f"ALTER TABLE {preparer.quote(table.name)} MODIFY COLUMN "
+                                  f"{_column_ddl(column, engine.dialect)}"))
+                widened.append(f"{table.name}.{column.name}")
+    return widened
+
+def _column_ddl(column, dialect) -> str:
+    """`name TYPE [NOT NULL] [DEFAULT x]` for ADD/MODIFY COLUMN"""
+    ddl = f"{dialect.identifier_preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    default = _scalar_default(column)
+    if default is not None:
+        ddl += f" DEFAULT {_sql_literal(default)}"
+    return ddl
+
+def _scalar_default(column):
+    return column.default.arg if column.default is not None and column.default.is_scalar else None
+
+def _sql_literal(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
 def get_db():
     with db_manager.get_session() as session:
         try:
+            if tracing():
+                # check out the pooled connection now so the wait for one is timed on its own
+                with stage("db_pool_wait"):
+                    session.connection()
             yield session
         finally:
             session.close()
@@ -0,0 +1,32 @@
+from sqlmodel import Session
+
+import stats
+from models import Upload, STATUS_PENDING
+from presign import presigned_urls
+from processing import delete_derived
+from upload_queue import upload_queue
+from vector_index import vector_index
+
+
+def delete_upload(session: Session, s3_client, bucket: str, upload: Upload):
+    """Delete a file everywhere, for the FastAPI and Streamlit apps alike.
+
+    The row (and its stats) is only committed once the S3 object is gone, so a failed S3
+    delete raises with nothing changed. Afterwards the staged body of a pending upload,
+    cached presigned URLs, derived artifacts and vector index chunks are dropped.
+    """
+    file_id, s3_key = upload.id, upload.s3_key
+    was_pending = upload.status == STATUS_PENDING
+    stats.apply(session, upload, -1)
+    session.delete(upload)
+    session.flush()
+    s3_client.delete_object(Bucket=bucket, Key=s3_key)
+    session.commit()
+
+    if was_pending and upload_queue.enabled:
+        # not in S3 yet; another process's queue deletes the object once its transfer finishes
+        upload_queue.discard(file_id)
+    presigned_urls.forget(s3_key)
+    delete_derived(s3_client, bucket, file_id)
+    if vector_index.enabled:
+        vector_index.delete(file_id)  # tombstone its chunks
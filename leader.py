@@ -0,0 +1,70 @@
+import os
+import fcntl
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """Elects the one process on this host that runs singleton background jobs (stats
+    recompute, backfill, tiering, scrubbing, ...): whoever holds an exclusive flock on `path`.
+
+    Under gunicorn every worker runs the app lifespan; the first to take the lock runs the
+    jobs, the others keep retrying so a replacement worker takes over when the leader dies
+    (the kernel drops the lock with the process).
+    """
+
+    def __init__(self):
+        self.is_leader = False
+        self._fd: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, path: str, on_elected: Callable[[], None], retry: float = 30.0):
+        self._stop.clear()
+        if self._try_acquire(path):
+            on_elected()
+            return
+        self._thread = threading.Thread(target=self._run, args=(path, on_elected, retry),
+                                        name="leader-lock", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self.is_leader = False
+
+    def _run(self, path: str, on_elected: Callable[[], None], retry: float):
+        while not self._stop.wait(retry):
+            if self._try_acquire(path):
+                try:
+                    on_elected()
+                except Exception:
+                    logger.exception("leader: starting background jobs failed")
+                return
+
+    def _try_acquire(self, path: str) -> bool:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        self.is_leader = True
+        logger.info("leader: pid %d runs the background jobs", os.getpid())
+        return True
+
+
+# Global instance
+leader_lock = LeaderLock()
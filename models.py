@@ -25,6 +25,14 @@ class FileListResponse(BaseModel):
     files: list[FileInfo] = []
     error: Optional[str] = None
 
+# Upload.status values
+STATUS_UPLOADED = 0  # uploaded to S3, not processed
+STATUS_PROCESSED = 1
+STATUS_PENDING = 2  # staged locally, waiting for the background S3 transfer
+STATUS_FAILED = 3  # background S3 transfer gave up after retries
+STATUS_PROCESSING = 4  # in S3, post-upload processing running (see processing.py)
+NOT_IN_S3 = (STATUS_PENDING, STATUS_FAILED)  # no object to download, scrub or tier
+
 # format saved in metadata table
 class Upload(SQLModel, table=True):
     id: str = Field(primary_key=True)
@@ -37,6 +45,118 @@ class Upload(SQLModel, table=True):
     file_type: str
     source_filename: str
     pages: int
-    status: int
+    status: int  # see STATUS_* above
     s3_key: str
     legacy_id: str | None = Field(default=None, max_length=255)
+    content_encoding: str | None = Field(default=None, max_length=16)  # "zstd" if stored compressed
+    stored_size: int | None = None  # bytes in S3, differs from size when compressed
+    storage_class: str | None = Field(default="STANDARD", max_length=32)
+    last_accessed: Optional[datetime] = None  # last download, drives storage tiering
+    etag: str | None = Field(default=None, max_length=64)  # S3 ETag when last scrubbed
+    sha256: str | None = Field(default=None, max_length=64)  # digest of the stored bytes
+    verified_at: Optional[datetime] = None  # last integrity scrub
+    scrub_status: str | None = Field(default=None, max_length=16)  # see scrubber.py
+    processing_started_at: Optional[datetime] = None  # claimed by a processing worker (STATUS_PROCESSING)
+
+
+class UploadQueueMetrics(BaseModel):
+    enabled: bool
+    workers: int = 0
+    depth: int = 0  # staged uploads waiting for or in S3 transfer
+    in_flight: int = 0
+    lag_seconds: float = 0.0  # age of the oldest staged upload
+    uploaded: int = 0
+    retried: int = 0
+    failed: int = 0
+
+
+class ScrubMetrics(BaseModel):
+    enabled: bool
+    passes: int = 0  # completed full passes over Upload
+    checked: int = 0  # head_object size/ETag checks
+    hashed: int = 0
+    bytes_hashed: int = 0
+    problems: dict[str, int] = {}  # scrub status -> count, e.g. {"size_mismatch": 1}
+    last_pass_at: Optional[datetime] = None
+
+
+class AdmissionMetrics(BaseModel):
+    enabled: bool
+    in_flight_bytes: int = 0
+    queued_now: int = 0  # requests currently waiting for bytes budget
+    admitted: int = 0
+    queued: int = 0  # requests that had to wait before admission
+    throttled_rate: int = 0  # 429s from the per-client rate limit
+    throttled_bytes: int = 0  # 429s after waiting max_wait for bytes budget
+
+
+class StatsResponse(BaseModel):
+    success: bool
+    group_by: list[str] = []
+    groups: list[dict] = []  # group_by columns + files + total_size (bytes)
+    error: Optional[str] = None
+
+
+class QueryResponse(BaseModel):
+    success: bool
+    sheet: Optional[str] = None
+    columns: list[str] = []
+    rows: list[dict] = []
+    total_rows: int = 0  # rows in the sheet, before filters
+    next_offset: Optional[int] = None  # pass as offset to get the next page
+    bytes_read: int = 0  # Parquet bytes fetched from S3 for this query
+    error: Optional[str] = None
+
+
+class ResumableCreateRequest(BaseModel):
+    upload_id: str  # client-generated, e.g. a UUID; reuse it to resume or retry
+    filename: str  # original file name, e.g. report.pdf
+    length: int  # total size in bytes
+    content_type: str = "application/octet-stream"
+    title: str = ""
+    authors: str = ""
+    language: str = ""
+    publication_date: Optional[datetime] = None
+
+
+class ResumableUploadResponse(BaseModel):
+    success: bool
+    upload_id: Optional[str] = None
+    offset: int = 0  # bytes committed; send the next chunk from here
+    length: int = 0
+    complete: bool = False
+    id: Optional[str] = None  # Upload.id, fixed when the upload is created
+    s3_key: Optional[str] = None
+    error: Optional[str] = None
+
+
+class SearchRequest(BaseModel):
+    queries: list[str] = Field(min_length=1, max_length=64)  # embedded and scored in one batch
+    k: int = Field(5, ge=1, le=100)
+
+class SearchHit(BaseModel):
+    upload_id: str
+    s3_key: Optional[str] = None
+    chunk: int
+    score: float  # cosine similarity
+    text: str
+
+class SearchResponse(BaseModel):
+    success: bool
+    results: list[list[SearchHit]] = []  # one list per query, best first
+    error: Optional[str] = None
+
+class CompactResponse(BaseModel):
+    success: bool
+    compacted: bool = False  # False: nothing tombstoned
+    rows: int = 0  # after compaction
+    live_rows: int = 0
+    error: Optional[str] = None
+
+
+class SlowRequestsResponse(BaseModel):
+    success: bool
+    threshold_ms: float = 0.0
+    profiling: bool = False  # background sampler armed: new entries carry folded stacks
+    requests: list[dict] = []  # method, path, status, duration_ms, stages, sql, [stacks]
+    error: Optional[str] = None
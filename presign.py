@@ -0,0 +1,69 @@
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import quote
+
+
+def content_disposition(filename: str) -> str:
+    """attachment header that survives non-ASCII (e.g. Chinese) names: ASCII fallback + RFC 5987"""
+    filename = unicodedata.normalize("NFC", filename)
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace('"', "").replace("?", "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+class PresignedUrlCache:
+    """Signs short-lived GET URLs and hands out the same URL while it still has at least
+    half its lifetime left, so hot files cost one signature per window instead of one per request"""
+
+    MAX_ENTRIES = 4096
+
+    def __init__(self):
+        self._s3 = None
+        self._bucket: Optional[str] = None
+        self.expires = 300
+        self._lock = threading.Lock()
+        self._urls: "OrderedDict[tuple, tuple[str, float]]" = OrderedDict()  # key -> (url, reuse until)
+
+    def configure(self, s3_client, bucket: str, expires: int = 300):
+        self._s3 = s3_client
+        self._bucket = bucket
+        self.expires = expires
+        with self._lock:
+            self._urls.clear()
+
+    def url(self, s3_key: str, filename: str, content_encoding: Optional[str] = None) -> str:
+        cache_key = (s3_key, filename, content_encoding)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._urls.get(cache_key)
+            if cached and cached[1] > now:
+                self._urls.move_to_end(cache_key)
+                return cached[0]
+
+        params = {
+            'Bucket': self._bucket,
+            'Key': s3_key,
+            'ResponseContentDisposition': content_disposition(filename),
+        }
+        if content_encoding:
+            params['ResponseContentEncoding'] = content_encoding
+        url = self._s3.generate_presigned_url('get_object', Params=params, ExpiresIn=self.expires)
+
+        with self._lock:
+            self._urls[cache_key] = (url, now + self.expires / 2)
+            self._urls.move_to_end(cache_key)
+            while len(self._urls) > self.MAX_ENTRIES:
+                self._urls.popitem(last=False)
+        return url
+
+    def forget(self, s3_key: str):
+        """Drop cached URLs for a deleted object"""
+        with self._lock:
+            for cache_key in [k for k in self._urls if k[0] == s3_key]:
+                del self._urls[cache_key]
+
+
+# Global instance
+presigned_urls = PresignedUrlCache()
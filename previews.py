@@ -0,0 +1,116 @@
+import io
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from processing import derived_prefix
+from models import Upload
+
+THUMBNAIL_WIDTH = 320
+SHEET_PREVIEW_ROWS = 20
+SHEET_PREVIEW_COLUMNS = 12
+
+# Previews live next to the original (uuid/filename) and never change for a given uuid,
+# so they can be cached forever by browsers and CDNs
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+PREVIEW_FILES = {
+    "pdf": ("preview.webp", "image/webp"),
+    "xls": ("preview.json", "application/json"),
+    "xlsx": ("preview.json", "application/json"),
+}
+
+
+def preview_key(upload: Upload) -> Optional[str]:
+    entry = PREVIEW_FILES.get(upload.file_type)
+    return derived_prefix(upload.id) + entry[0] if entry else None
+
+
+# ====== Rendering (runs in worker processes) ======
+def render_pdf_thumbnail(local_path: str) -> bytes:
+    """First page as a THUMBNAIL_WIDTH-wide WebP"""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(local_path)
+    try:
+        page = pdf[0]
+        scale = THUMBNAIL_WIDTH / page.get_width()
+        image = page.render(scale=scale).to_pil()
+    finally:
+        pdf.close()
+    out = io.BytesIO()
+    image.convert("RGB").save(out, format="WEBP", quality=80, method=4)
+    return out.getvalue()
+
+
+def render_sheet_preview(local_path: str) -> bytes:
+    """Head of the first sheet: sheet names, column names and the first rows as JSON"""
+    import pandas as pd
+
+    workbook = pd.ExcelFile(local_path)
+    df = workbook.parse(workbook.sheet_names[0], nrows=SHEET_PREVIEW_ROWS)
+    df = df.iloc[:, :SHEET_PREVIEW_COLUMNS]
+    preview = {
+        "sheets": workbook.sheet_names,
+        "sheet": workbook.sheet_names[0],
+        "columns": [str(c) for c in df.columns],
+        "rows": [[None if pd.isna(v) else str(v) for v in row] for row in df.itertuples(index=False)],
+    }
+    return json.dumps(preview, ensure_ascii=False, default=str).encode()
+
+
+def render_preview(file_type: str, local_path: str) -> bytes:
+    if file_type == "pdf":
+        return render_pdf_thumbnail(local_path)
+    return render_sheet_preview(local_path)
+
+
+# ====== Generation (processing handler) ======
+class PreviewRenderer:
+    """Process pool for CPU-heavy rendering, so it neither holds the GIL nor blocks requests"""
+
+    def __init__(self):
+        self.processes = 2
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()  # processing threads render concurrently
+
+    def configure(self, processes: int):
+        self.processes = processes
+
+    def render(self, file_type: str, local_path: str) -> bytes:
+        return self._get_pool().submit(render_preview, file_type, local_path).result()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Created on first use so workers that never render don't spawn processes
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: the app process runs threads (upload queue, processing, ...)
+                self._pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+# Global instance
+preview_renderer = PreviewRenderer()
+
+
+def generate_preview(s3_client, bucket: str, upload: Upload, local_path: str):
+    """Processing handler: render and store the preview of a PDF or spreadsheet"""
+    key = preview_key(upload)
+    if key is None:
+        return
+    body = preview_renderer.render(upload.file_type, local_path)
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=body,
+        ContentType=PREVIEW_FILES[upload.file_type][1],
+        CacheControl=CACHE_CONTROL
+    )
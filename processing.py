@@ -0,0 +1,235 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlmodel import select, update, or_
+
+import stats
+from db import db_manager
+from storage_policy import storage_policy
+from models import Upload, STATUS_UPLOADED, STATUS_PROCESSED, STATUS_PROCESSING
+
+logger = logging.getLogger(__name__)
+
+# handler(s3_client, bucket, upload, local_path): derive something from an uploaded file.
+# Handlers must be idempotent (a file can be processed again after a failure or backfill)
+# and store their outputs under derived_prefix(upload.id).
+Handler = Callable[[object, str, Upload, str], None]
+
+
+def derived_prefix(file_id: str) -> str:
+    """S3 prefix for artifacts derived from an upload, next to its uuid/filename object"""
+    return f"{file_id}/_derived/"
+
+
+def delete_derived(s3_client, bucket: str, file_id: str):
+    """Delete every derived artifact of an upload"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=derived_prefix(file_id)):
+        keys = [{'Key': item['Key']} for item in page.get('Contents', [])]
+        if keys:
+            s3_client.delete_objects(Bucket=bucket, Delete={'Objects': keys, 'Quiet': True})
+
+
+class Processor:
+    """Runs registered handlers on files once they are in S3, then marks them processed.
+
+    A file claimed by a worker that died (crash, OOM kill, deploy) would stay in
+    STATUS_PROCESSING forever; the reclaimer hands files processing for longer than
+    `timeout` back to the queue.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.handlers: list[tuple[str, Handler]] = []
+        self._s3 = None
+        self._bucket: Optional[str] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending: set[str] = set()
+        self.timeout = timedelta(hours=1)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def register(self, name: str, handler: Handler):
+        self.handlers.append((name, handler))
+
+    def start(self, s3_client, bucket: str, workers: int = 2, backfill: bool = False,
+              timeout: timedelta = timedelta(hours=1)):
+        """timeout: longest a handler run may take before the file is handed out again"""
+        self._s3 = s3_client
+        self._bucket = bucket
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="processing")
+        self.enabled = True
+        if backfill:
+            self.submit_backfill()
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(10.0)
+            self._thread = None
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def start_reclaimer(self, interval: float = 300.0):
+        """Reclaim stale claims every `interval` seconds (run it from one process only)"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run_reclaimer, args=(interval,),
+                                        name="processing-reclaim", daemon=True)
+        self._thread.start()
+
+    def _run_reclaimer(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                reclaimed = self.reclaim()
+                if reclaimed:
+                    logger.info("processing: reclaimed %d stale files", reclaimed)
+            except Exception:
+                logger.exception("processing: reclaim failed")
+
+    def submit(self, file_id: str):
+        """Queue an uploaded file for processing (no-op if processing is off)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if file_id in self._pending:
+                return
+            self._pending.add(file_id)
+        self._executor.submit(self._process, file_id)
+
+    def submit_backfill(self):
+        """Queue a backfill scan on the worker pool (run it from one process only)"""
+        if self.enabled:
+            self._executor.submit(self.backfill)
+
+    def reclaim(self) -> int:
+        """Move files stuck in STATUS_PROCESSING for longer than `timeout` back to
+        STATUS_UPLOADED and queue them again; returns how many"""
+        cutoff = datetime.now() - self.timeout
+        with db_manager.get_session() as session:
+            ids = session.exec(
+                select(Upload.id).where(
+                    Upload.status == STATUS_PROCESSING,
+                    or_(Upload.processing_started_at < cutoff, Upload.processing_started_at.is_(None))
+                )
+            ).all()
+        reclaimed = 0
+        for file_id in ids:
+            with db_manager.get_session() as session:
+                # conditional, so a worker that finished meanwhile keeps its result
+                result = session.exec(
+                    update(Upload)
+                    .where(Upload.id == file_id, Upload.status == STATUS_PROCESSING,
+                           or_(Upload.processing_started_at < cutoff, Upload.processing_started_at.is_(None)))
+                    .values(status=STATUS_UPLOADED, processing_started_at=None)
+                )
+                if result.rowcount != 1:
+                    session.rollback()
+                    continue
+                stats.move(session, session.get(Upload, file_id), STATUS_PROCESSING)
+                session.commit()
+            reclaimed += 1
+            self.submit(file_id)
+        return reclaimed
+
+    def backfill(self, batch_size: int = 100):
+        """Queue every file that is in S3 but not processed yet, including stale claims"""
+        self.reclaim()
+        last_id = ""
+        while self.enabled:
+            with db_manager.get_session() as session:
+                statement = (
+                    select(Upload.id)
+                    .where(Upload.id > last_id, Upload.status == STATUS_UPLOADED)
+                    .order_by(Upload.id)
+                    .limit(batch_size)
+                )
+                ids = session.exec(statement).all()
+            if not ids:
+                return
+            for file_id in ids:
+                self.submit(file_id)
+            last_id = ids[-1]
+
+    def _process(self, file_id: str):
+        try:
+            if not self._claim(file_id):
+                return  # already claimed by another worker process, or deleted
+            try:
+                with db_manager.get_session() as session:
+                    upload = session.get(Upload, file_id)
+                if upload is None:
+                    return
+                self._run_handlers(upload)
+            except Exception:
+                logger.exception("processing: %s failed", file_id)
+                self._finish(file_id, STATUS_UPLOADED)  # picked up again by the next backfill
+                return
+            self._finish(file_id, STATUS_PROCESSED)
+        finally:
+            with self._lock:
+                self._pending.discard(file_id)
+
+    def _run_handlers(self, upload: Upload):
+        workdir = tempfile.mkdtemp(prefix="processing-")
+        try:
+            local_path = os.path.join(workdir, "source." + (upload.file_type or "bin"))
+            self._fetch(upload, local_path)
+            for name, handler in self.handlers:
+                handler(self._s3, self._bucket, upload, local_path)
+                logger.info("processing: %s done for %s", name, upload.s3_key)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _fetch(self, upload: Upload, local_path: str):
+        """Download the original bytes (decompressed if stored with a content encoding)"""
+        response = self._s3.get_object(Bucket=self._bucket, Key=upload.s3_key)
+        chunks = response['Body'].iter_chunks(chunk_size=1024 * 1024)
+        if upload.content_encoding:
+            chunks = storage_policy.decompress(chunks, upload.content_encoding)
+        with open(local_path, "wb") as out:
+            for chunk in chunks:
+                out.write(chunk)
+
+    def _claim(self, file_id: str) -> bool:
+        """Atomically move uploaded -> processing so only one process works on a file"""
+        with db_manager.get_session() as session:
+            result = session.exec(
+                update(Upload)
+                .where(Upload.id == file_id, Upload.status == STATUS_UPLOADED)
+                .values(status=STATUS_PROCESSING, processing_started_at=datetime.now())
+            )
+            if result.rowcount != 1:
+                session.rollback()
+                return False
+            upload = session.get(Upload, file_id)
+            stats.move(session, upload, STATUS_UPLOADED)
+            session.commit()
+            return True
+
+    def _finish(self, file_id: str, status: int):
+        with db_manager.get_session() as session:
+            upload = session.get(Upload, file_id)
+            if upload is None:
+                # deleted while processing: the delete may have run before the handlers wrote
+                # their outputs, so remove what they left behind
+                delete_derived(self._s3, self._bucket, file_id)
+                return
+            old_status, upload.status = upload.status, status
+            upload.processing_started_at = None
+            session.add(upload)
+            stats.move(session, upload, old_status)
+            session.commit()
+
+
+# Global instance
+processor = Processor()
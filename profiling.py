@@ -0,0 +1,274 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MAX_SQL_PER_REQUEST = 50
+MAX_SQL_LENGTH = 500
+MAX_STACK_DEPTH = 128
+
+
+class RequestTrace:
+    """Per-request timings, shared by the event loop and threadpool (contextvars are copied
+    into run_in_threadpool, the object they point to is the same)"""
+
+    __slots__ = ("method", "path", "started", "started_at", "stages", "sql", "sql_ms", "sql_count")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        self.stages: dict[str, float] = {}  # stage -> total ms
+        self.sql: list[dict] = []
+        self.sql_ms = 0.0
+        self.sql_count = 0
+
+    def add_stage(self, name: str, ms: float):
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def add_sql(self, statement: str, ms: float):
+        self.sql_ms += ms
+        self.sql_count += 1
+        if len(self.sql) < MAX_SQL_PER_REQUEST:
+            self.sql.append({"statement": statement[:MAX_SQL_LENGTH], "ms": round(ms, 3)})
+
+
+_trace: ContextVar[Optional[RequestTrace]] = ContextVar("rmi_request_trace", default=None)
+
+
+def tracing() -> bool:
+    return _trace.get() is not None
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a named stage of the current request (no-op outside traced requests)"""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, (time.perf_counter() - start) * 1000)
+
+
+# SQL capture: every engine, only while a traced request is running
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _trace.get() is not None:
+        conn.info.setdefault("rmi_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+    starts = conn.info.get("rmi_query_start")
+    if trace is not None and starts:
+        trace.add_sql(statement, (time.perf_counter() - starts.pop()) * 1000)
+
+
+# Folded stacks repeat from sample to sample (idle threadpool threads all wait in the same
+# place): a stack is keyed by its code objects and bytecode offsets, which are cheap to read,
+# and labels are only formatted the first time a code object/line shows up
+MAX_CACHED_STACKS = 10000
+_labels: dict = {}
+_folded: dict = {}
+
+
+def _label(code, lineno: int) -> str:
+    key = (code, lineno)
+    label = _labels.get(key)
+    if label is None:
+        if len(_labels) >= MAX_CACHED_STACKS:
+            _labels.clear()
+        label = _labels[key] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{lineno})"
+    return label
+
+
+def fold(frame, thread_name: str) -> str:
+    """One stack in the folded format of flamegraph.pl / speedscope: root;...;leaf"""
+    key = [thread_name]
+    leaf, depth = frame, 0
+    while frame is not None and depth < MAX_STACK_DEPTH:
+        key.append(frame.f_code)
+        key.append(frame.f_lasti)
+        frame = frame.f_back
+        depth += 1
+    key = tuple(key)
+    folded = _folded.get(key)
+    if folded is None:
+        labels = []
+        frame = leaf
+        for _ in range(depth):
+            labels.append(_label(frame.f_code, frame.f_lineno))
+            frame = frame.f_back
+        labels.append(thread_name)
+        if len(_folded) >= MAX_CACHED_STACKS:
+            _folded.clear()
+        folded = _folded[key] = ";".join(reversed(labels))
+    return folded
+
+
+class Profiler:
+    """Sampling profiler over sys._current_frames() plus slow-request capture.
+
+    `sample(seconds)` profiles every thread for a fixed window. `arm(seconds)` keeps the
+    sampler running in the background so slow requests finishing in that window get the
+    stacks sampled while they ran attached to their record.
+    """
+
+    def __init__(self):
+        self.slow_ms = 0.0  # 0 = no slow-request capture
+        self.interval = 0.01
+        self._slow: deque = deque(maxlen=100)
+        self._lock = threading.Lock()
+        self._sampling = threading.Lock()  # one sampler at a time
+        self._armed_until = 0.0
+        self._recent: deque = deque()  # (timestamp, folded stack) while armed
+        self._recent_window = 60.0
+
+    def configure(self, slow_ms: float, capacity: int = 100, interval: float = 0.01):
+        self.slow_ms = slow_ms
+        self.interval = interval
+        with self._lock:
+            self._slow = deque(self._slow, maxlen=capacity)
+
+    @property
+    def enabled(self) -> bool:
+        return self.slow_ms > 0
+
+    # ---- sampling ----
+    def _take_sample(self, own_ident: int) -> list[str]:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        return [
+            fold(frame, names.get(ident, str(ident)))
+            for ident, frame in sys._current_frames().items()
+            if ident != own_ident
+        ]
+
+    def sample(self, seconds: float) -> Optional[Counter]:
+        """Sample all threads for `seconds`; None if another sampler is running"""
+        if not self._sampling.acquire(blocking=False):
+            return None
+        try:
+            own = threading.get_ident()
+            stacks: Counter = Counter()
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                stacks.update(self._take_sample(own))
+                time.sleep(self.interval)
+            return stacks
+        finally:
+            self._sampling.release()
+
+    def arm(self, seconds: float) -> bool:
+        """Sample in the background for `seconds`, for slow-request stacks"""
+        if not self._sampling.acquire(blocking=False):
+            return False
+        self._armed_until = time.perf_counter() + seconds
+        threading.Thread(target=self._run_armed, name="profiler", daemon=True).start()
+        return True
+
+    @property
+    def armed(self) -> bool:
+        return self._armed_until > time.perf_counter()
+
+    def _run_armed(self):
+        own = threading.get_ident()
+        try:
+            while self.armed:
+                now = time.perf_counter()
+                samples = self._take_sample(own)
+                with self._lock:
+                    self._recent.extend((now, stack) for stack in samples)
+                    while self._recent and self._recent[0][0] < now - self._recent_window:
+                        self._recent.popleft()
+                time.sleep(self.interval)
+        finally:
+            with self._lock:
+                self._recent.clear()
+            self._sampling.release()
+
+    def _stacks_between(self, start: float, end: float) -> Counter:
+        with self._lock:
+            return Counter(stack for t, stack in self._recent if start <= t <= end)
+
+    # ---- slow requests ----
+    def record(self, trace: RequestTrace, status: int):
+        end = time.perf_counter()
+        duration_ms = (end - trace.started) * 1000
+        if not self.enabled or duration_ms < self.slow_ms:
+            return
+        entry = {
+            "method": trace.method,
+            "path": trace.path,
+            "status": status,
+            "started_at": trace.started_at.isoformat(),
+            "duration_ms": round(duration_ms, 3),
+            "stages": {name: round(ms, 3) for name, ms in trace.stages.items()},
+            "sql_count": trace.sql_count,
+            "sql_ms": round(trace.sql_ms, 3),
+            "sql": trace.sql,
+        }
+        if self.armed:
+            entry["stacks"] = format_folded(self._stacks_between(trace.started, end))
+        with self._lock:
+            self._slow.append(entry)
+
+    def slow_requests(self, limit: int = 100) -> list[dict]:
+        """Most recent first"""
+        with self._lock:
+            return list(self._slow)[::-1][:limit]
+
+
+def format_folded(stacks: Counter) -> str:
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+
+# Global instance
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware: traces every request while slow-request capture is on"""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = _trace.set(trace)
+        status = 500
+        first_byte: Optional[float] = None
+
+        async def send_wrapper(message):
+            nonlocal status, first_byte
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                first_byte = time.perf_counter()
+                trace.add_stage("until_response_start", (first_byte - trace.started) * 1000)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if first_byte is not None:
+                trace.add_stage("response_body", (time.perf_counter() - first_byte) * 1000)
+            _trace.reset(token)
+            self.profiler.record(trace, status)
@@ -0,0 +1,389 @@
+import os
+import re
+import json
+import uuid
+import logging
+import threading
+import unicodedata
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import BinaryIO, Optional
+
+from botocore.exceptions import ClientError
+from sqlalchemy import case, update
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel, Field, Session, select
+
+import stats
+from db import db_manager
+from models import Upload, STATUS_UPLOADED
+
+logger = logging.getLogger(__name__)
+
+# S3 multipart: every part but the last must be at least 5 MiB, and there are at most 10000
+MIN_CHUNK_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+UPLOAD_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+# ResumableUpload.state values
+STATE_OPEN = "open"
+STATE_COMPLETE = "complete"
+
+
+# One row per client-supplied upload ID. Each chunk the client sends is one S3 multipart part;
+# `offset` only moves once S3 has acknowledged the part, so a broken chunk is simply resent.
+class ResumableUpload(SQLModel, table=True):
+    id: str = Field(primary_key=True, max_length=64)  # client-supplied upload ID
+    file_id: str = Field(max_length=32)  # Upload.id, fixed at creation so retries can't fork it
+    s3_key: str
+    s3_upload_id: str  # S3 multipart UploadId
+    source_filename: str
+    file_type: str = Field(max_length=16)
+    content_type: str = Field(max_length=255)
+    filename: str
+    author: str
+    language: str
+    publication_date: Optional[datetime] = None
+    length: int  # declared total size in bytes
+    offset: int = 0  # bytes committed to S3
+    parts: str = "[]"  # JSON [{"PartNumber": n, "ETag": "..."}], in order
+    next_part: int = 1  # next unreserved part number; retried chunks skip numbers
+    state: str = Field(default=STATE_OPEN, max_length=16)
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+    updated_at: datetime = Field(default_factory=lambda: datetime.now())
+
+
+class UploadConflict(Exception):
+    """Request doesn't fit the upload's current state; `offset` is where the client resumes"""
+
+    def __init__(self, message: str, offset: Optional[int] = None):
+        super().__init__(message)
+        self.offset = offset
+
+
+class ResumableUploads:
+    """S3 multipart-backed resumable uploads (create -> PUT chunks at offsets -> complete).
+
+    Every step is idempotent: creating an existing upload ID returns it, a chunk at an
+    already committed offset is refused with the offset to resume from, and completing twice
+    returns the same Upload. A janitor aborts uploads left open longer than `ttl`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._s3 = None
+        self._bucket: Optional[str] = None
+        self.ttl = timedelta(days=7)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def configure(self, s3_client, bucket: str):
+        self._s3 = s3_client
+        self._bucket = bucket
+
+    def start(self, ttl: timedelta = timedelta(days=7), interval: float = 3600.0):
+        """Run the janitor for abandoned uploads"""
+        self.ttl = ttl
+        self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="resumable-janitor", daemon=True)
+        self._thread.start()
+        self.enabled = True
+
+    def stop(self, timeout: float = 10.0):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        self._thread.join(timeout)
+
+    # ---- protocol ----
+    def create(self, upload_id: str, source_filename: str, length: int, content_type: str,
+               filename: str = "", author: str = "", language: str = "",
+               publication_date: Optional[datetime] = None) -> ResumableUpload:
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            raise ValueError("upload_id must be 8-64 characters of A-Z, a-z, 0-9, _ or -")
+        if length < 0:
+            raise ValueError("length must be >= 0")
+        source_filename = unicodedata.normalize("NFC", os.path.basename(source_filename))
+
+        with db_manager.get_session() as session:
+            existing = session.get(ResumableUpload, upload_id)
+            if existing:
+                if existing.source_filename != source_filename or existing.length != length:
+                    raise UploadConflict(f"Upload ID {upload_id} is in use for another file")
+                return existing
+
+            file_id = str(uuid.uuid4().hex)
+            s3_key = f"{file_id}/{source_filename}"
+            multipart = self._s3.create_multipart_upload(
+                Bucket=self._bucket,
+                Key=s3_key,
+                ContentType=content_type,
+                Metadata={'id': file_id}
+            )
+            record = ResumableUpload(
+                id=upload_id,
+                file_id=file_id,
+                s3_key=s3_key,
+                s3_upload_id=multipart['UploadId'],
+                source_filename=source_filename,
+                file_type=source_filename.rsplit('.', 1)[-1].lower() if '.' in source_filename else '',
+                content_type=content_type,
+                filename=filename.strip(),
+                author=author.strip(),
+                language=language,
+                publication_date=publication_date,
+                length=length
+            )
+            session.add(record)
+            try:
+                session.commit()
+            except Exception:
+                # lost a race for the same upload ID: keep the winner's multipart upload
+                session.rollback()
+                self._abort(s3_key, multipart['UploadId'])
+                existing = session.get(ResumableUpload, upload_id)
+                if existing is None:
+                    raise
+                return existing
+            session.refresh(record)
+            return record
+
+    def get(self, upload_id: str) -> Optional[ResumableUpload]:
+        with db_manager.get_session() as session:
+            return session.get(ResumableUpload, upload_id)
+
+    def write_chunk(self, upload_id: str, offset: int, body: BinaryIO, size: int,
+                    content_md5: Optional[str] = None) -> ResumableUpload:
+        """Store `size` bytes at `offset` as the next multipart part; returns the new state"""
+        # No row lock across the S3 call: check the offset, upload the part, then commit with
+        # a conditional UPDATE that only succeeds if nobody moved the offset meanwhile
+        with self._busy():
+            with db_manager.get_session() as session:
+                record = session.get(ResumableUpload, upload_id)
+                if record is None:
+                    raise KeyError(upload_id)
+                self._check_open(record, offset)
+                if size == 0:
+                    return record
+                end = offset + size
+                if end > record.length:
+                    raise ValueError(f"Chunk ends at {end}, past the declared length {record.length}")
+                if end < record.length and size < MIN_CHUNK_SIZE:
+                    raise ValueError(f"Chunks before the last one must be at least {MIN_CHUNK_SIZE} bytes")
+                parts = json.loads(record.parts)
+                s3_key, s3_upload_id = record.s3_key, record.s3_upload_id
+                part_number = self._reserve_part(session, record, parts)
+
+            params = {
+                'Bucket': self._bucket,
+                'Key': s3_key,
+                'UploadId': s3_upload_id,
+                'PartNumber': part_number,
+                'Body': body,
+                'ContentLength': size,
+            }
+            if content_md5:
+                params['ContentMD5'] = content_md5  # S3 rejects the part if the bytes differ
+            response = self._s3.upload_part(**params)
+
+            parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+            with db_manager.get_session() as session:
+                result = session.exec(
+                    update(ResumableUpload)
+                    .where(ResumableUpload.id == upload_id,
+                           ResumableUpload.offset == offset,
+                           ResumableUpload.state == STATE_OPEN)
+                    .values(offset=end, parts=json.dumps(parts), updated_at=datetime.now())
+                )
+                session.commit()
+                record = session.get(ResumableUpload, upload_id)
+                if result.rowcount == 0:
+                    # another request committed this offset first; S3 drops our unlisted part
+                    if record is None:
+                        raise KeyError(upload_id)
+                    raise UploadConflict(f"Offset {offset} doesn't match the committed offset", record.offset)
+                return record
+
+    def complete(self, upload_id: str) -> tuple[ResumableUpload, Upload, bool]:
+        """Finish the multipart upload and create its Upload row; returns (state, upload,
+        created) where created is False when an earlier call already completed it"""
+        with self._busy():
+            record = self.get(upload_id)
+            if record is None:
+                raise KeyError(upload_id)
+            if record.state != STATE_COMPLETE:
+                if record.offset != record.length:
+                    raise UploadConflict(f"Only {record.offset} of {record.length} bytes received", record.offset)
+                # outside any transaction; a concurrent completion makes this a NoSuchUpload no-op
+                self._finish_multipart(record)
+
+            with db_manager.get_session() as session:
+                result = session.exec(
+                    update(ResumableUpload)
+                    .where(ResumableUpload.id == upload_id,
+                           ResumableUpload.state == STATE_OPEN,
+                           ResumableUpload.offset == ResumableUpload.length)
+                    .values(state=STATE_COMPLETE, updated_at=datetime.now())
+                )
+                if result.rowcount == 0:
+                    session.rollback()
+                    record = session.get(ResumableUpload, upload_id)
+                    if record is None:
+                        raise KeyError(upload_id)
+                    if record.state != STATE_COMPLETE:
+                        raise UploadConflict(f"Only {record.offset} of {record.length} bytes received", record.offset)
+                    return record, session.get(Upload, record.file_id), False
+
+                upload = Upload(
+                    id=record.file_id,
+                    filename=record.filename,
+                    author=record.author,
+                    language=record.language,
+                    publication_date=record.publication_date,
+                    size=record.length,
+                    file_type=record.file_type,
+                    source_filename=record.source_filename,
+                    pages=0,
+                    status=STATUS_UPLOADED,
+                    s3_key=record.s3_key,
+                    stored_size=record.length
+                )
+                session.add(upload)
+                stats.apply(session, upload)
+                session.commit()
+                session.refresh(upload)
+                return session.get(ResumableUpload, upload_id), upload, True
+
+    def abort(self, upload_id: str) -> bool:
+        """Drop an unfinished upload and its parts; False if there is nothing to abort"""
+        with db_manager.get_session() as session:
+            record = self._lock(session, upload_id, required=False)
+            if record is None or record.state == STATE_COMPLETE:
+                return False
+            self._abort(record.s3_key, record.s3_upload_id)
+            session.delete(record)
+            session.commit()
+            return True
+
+    # ---- internals ----
+    @staticmethod
+    @contextmanager
+    def _busy():
+        """A lock wait timeout / deadlock means another request holds the row: 409, retry"""
+        try:
+            yield
+        except OperationalError as e:
+            logger.warning("resumable uploads: database busy: %s", e.orig)
+            raise UploadConflict("Upload is busy, retry the request") from e
+
+    @staticmethod
+    def _check_open(record: ResumableUpload, offset: int):
+        if record.state == STATE_COMPLETE:
+            raise UploadConflict("Upload is already complete", record.offset)
+        if offset != record.offset:
+            raise UploadConflict(f"Offset {offset} doesn't match the committed offset", record.offset)
+
+    @staticmethod
+    def _reserve_part(session: Session, record: ResumableUpload, parts: list) -> int:
+        """Claim a part number above every committed part, unique even among concurrent
+        writers of the same offset (so one can't overwrite the part the other commits)"""
+        floor = parts[-1]['PartNumber'] + 1 if parts else 1
+        result = session.exec(
+            update(ResumableUpload)
+            .where(ResumableUpload.id == record.id,
+                   ResumableUpload.offset == record.offset,
+                   ResumableUpload.state == STATE_OPEN)
+            .values(next_part=case((ResumableUpload.next_part > floor, ResumableUpload.next_part),
+                                   else_=floor) + 1)
+        )
+        current = session.exec(
+            select(ResumableUpload.next_part, ResumableUpload.offset).where(ResumableUpload.id == record.id)
+        ).first()
+        session.commit()
+        if result.rowcount == 0:
+            raise UploadConflict(f"Offset {record.offset} doesn't match the committed offset",
+                                 current.offset if current else None)
+        part_number = current.next_part - 1
+        if part_number > MAX_PARTS:
+            raise ValueError(f"At most {MAX_PARTS} chunks per upload")
+        return part_number
+
+    @staticmethod
+    def _lock(session: Session, upload_id: str, required: bool = True) -> Optional[ResumableUpload]:
+        record = session.exec(
+            select(ResumableUpload).where(ResumableUpload.id == upload_id).with_for_update()
+        ).first()
+        if record is None and required:
+            raise KeyError(upload_id)
+        return record
+
+    def _finish_multipart(self, record: ResumableUpload):
+        parts = json.loads(record.parts)
+        try:
+            if not parts:
+                # S3 can't complete a multipart upload without parts: store the empty file directly
+                self._abort(record.s3_key, record.s3_upload_id)
+                self._s3.put_object(Bucket=self._bucket, Key=record.s3_key, Body=b"",
+                                    ContentType=record.content_type, Metadata={'id': record.file_id})
+                return
+            self._s3.complete_multipart_upload(
+                Bucket=self._bucket,
+                Key=record.s3_key,
+                UploadId=record.s3_upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except ClientError as e:
+            # S3 completed it but we crashed before the commit: the object is there, carry on
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+            head = self._s3.head_object(Bucket=self._bucket, Key=record.s3_key)
+            if head['ContentLength'] != record.length:
+                raise
+
+    def _abort(self, s3_key: str, s3_upload_id: str):
+        try:
+            self._s3.abort_multipart_upload(Bucket=self._bucket, Key=s3_key, UploadId=s3_upload_id)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                expired = self.expire()
+                if expired:
+                    logger.info("resumable uploads: aborted %d abandoned uploads", expired)
+            except Exception:
+                logger.exception("resumable uploads: janitor pass failed")
+            self._stop.wait(self.interval)
+
+    def expire(self, batch_size: int = 100) -> int:
+        """Abort open uploads not written to for `ttl`; forget completed ones after `ttl`"""
+        cutoff = datetime.now() - self.ttl
+        removed = 0
+        while not self._stop.is_set():
+            with db_manager.get_session() as session:
+                ids = session.exec(
+                    select(ResumableUpload.id)
+                    .where(ResumableUpload.updated_at < cutoff)
+                    .limit(batch_size)
+                ).all()
+            if not ids:
+                break
+            for upload_id in ids:
+                with db_manager.get_session() as session:
+                    record = self._lock(session, upload_id, required=False)
+                    if record is None or record.updated_at >= cutoff:
+                        continue
+                    if record.state == STATE_OPEN:
+                        self._abort(record.s3_key, record.s3_upload_id)
+                    session.delete(record)
+                    session.commit()
+                    removed += 1
+        return removed
+
+
+# Global instance
+resumable_uploads = ResumableUploads()
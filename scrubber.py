@@ -0,0 +1,233 @@
+import hashlib
+import logging
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from botocore.exceptions import ClientError
+from sqlmodel import select
+
+from admission import TokenBucket
+from db import db_manager
+from models import Upload, ScrubMetrics, NOT_IN_S3
+
+logger = logging.getLogger(__name__)
+
+# Upload.scrub_status values
+SCRUB_OK = "ok"
+SCRUB_MISSING = "missing"  # no object at s3_key
+SCRUB_SIZE_MISMATCH = "size_mismatch"  # object size != stored_size (truncated/partial upload)
+SCRUB_ETAG_MISMATCH = "etag_mismatch"  # object replaced since the last scrub
+SCRUB_HASH_MISMATCH = "hash_mismatch"  # bytes differ from the recorded sha256 / single-part MD5 ETag
+
+# Hashing reads the whole object, so only do it where GETs are free; IA/Glacier IR bill retrievals
+HASHABLE_CLASSES = {None, "STANDARD", "INTELLIGENT_TIERING"}
+PART_SIZE = 8 * 1024 * 1024
+
+
+class Scrubber:
+    """Background integrity checks over every file in S3.
+
+    Each pass walks Upload in id order: a head_object per row (concurrently) checks that the
+    object exists with the expected size and ETag, and a random `hash_fraction` of rows is
+    stream-hashed with parallel ranged GETs and compared with the recorded sha256. Rows/s and
+    hashing bytes/s are capped by token buckets so a continuous scrub stays in the background.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._s3 = None
+        self._bucket: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._passes = 0
+        self._checked = 0
+        self._hashed = 0
+        self._bytes_hashed = 0
+        self._problems: Counter = Counter()
+        self._last_pass_at: Optional[datetime] = None
+
+    def start(self, s3_client, bucket: str, rate: float = 10.0, bandwidth: int = 8 * 1024 * 1024,
+              hash_fraction: float = 0.01, workers: int = 4, interval: float = 86400.0, batch_size: int = 100):
+        """rate: rows/s; bandwidth: hashing bytes/s; interval: pause between full passes"""
+        self._s3 = s3_client
+        self._bucket = bucket
+        self.hash_fraction = hash_fraction
+        self.workers = workers
+        self.interval = interval
+        self.batch_size = batch_size
+        self._rows = TokenBucket(rate, max(rate, 1.0))
+        self._bytes = TokenBucket(bandwidth, max(bandwidth, PART_SIZE))  # burst must fit one range
+        self._bytes_lock = threading.Lock()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="scrubber", daemon=True)
+        self._thread.start()
+        self.enabled = True
+
+    def stop(self, timeout: float = 10.0):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def metrics(self) -> ScrubMetrics:
+        with self._lock:
+            return ScrubMetrics(
+                enabled=self.enabled,
+                passes=self._passes,
+                checked=self._checked,
+                hashed=self._hashed,
+                bytes_hashed=self._bytes_hashed,
+                problems=dict(self._problems),
+                last_pass_at=self._last_pass_at
+            )
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("scrubber: pass failed")
+            self._stop.wait(self.interval)
+
+    def run_once(self):
+        """One full pass over Upload"""
+        last_id = ""
+        # ranges outermost: exiting shuts heads down first, and head tasks may still hash
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="scrub-range") as ranges, \
+                ThreadPoolExecutor(self.workers, thread_name_prefix="scrub") as heads:
+            self._ranges = ranges
+            while not self._stop.is_set():
+                with db_manager.get_session() as session:
+                    statement = (
+                        select(Upload)
+                        .where(Upload.id > last_id, Upload.status.not_in(NOT_IN_S3))
+                        .order_by(Upload.id)
+                        .limit(self.batch_size)
+                    )
+                    batch = session.exec(statement).all()
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                for upload in batch:
+                    self._wait(self._rows, 1)
+                    if self._stop.is_set():
+                        return
+                    heads.submit(self._scrub_logged, upload)
+        with self._lock:
+            self._passes += 1
+            self._last_pass_at = datetime.now()
+
+    def _wait(self, bucket: TokenBucket, cost: float, lock: Optional[threading.Lock] = None):
+        """Block until `bucket` has `cost` tokens (or the scrubber stops)"""
+        while not self._stop.is_set():
+            if lock:
+                with lock:
+                    delay = bucket.take(cost)
+            else:
+                delay = bucket.take(cost)
+            if delay <= 0:
+                return
+            self._stop.wait(delay)
+
+    def _scrub_logged(self, upload: Upload):
+        try:
+            self.scrub(upload)
+        except Exception as e:
+            logger.warning("scrubber: could not check %s: %s", upload.s3_key, e)
+
+    def scrub(self, upload: Upload) -> str:
+        """Check one upload, record the result on its row; returns the scrub status"""
+        sha256 = etag = None
+        try:
+            head = self._s3.head_object(Bucket=self._bucket, Key=upload.s3_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            status = SCRUB_MISSING
+        else:
+            # Compare with the row as it is now, not as it was when the batch was read: the
+            # storage tierer may have copied the object (new ETag) and reset `etag` meanwhile
+            with db_manager.get_session() as session:
+                upload = session.get(Upload, upload.id)
+            if upload is None:
+                return SCRUB_MISSING  # deleted meanwhile, nothing to record
+            etag = head['ETag'].strip('"')
+            expected_size = upload.stored_size if upload.stored_size is not None else upload.size
+            if head['ContentLength'] != expected_size:
+                status = SCRUB_SIZE_MISMATCH
+            elif upload.etag and etag != upload.etag:
+                status = SCRUB_ETAG_MISMATCH
+            else:
+                status = SCRUB_OK
+                if upload.storage_class in HASHABLE_CLASSES and random.random() < self.hash_fraction:
+                    sha256, md5 = self._hash(upload.s3_key, head['ContentLength'])
+                    # Single-part uploads without SSE-KMS have the MD5 of the body as ETag
+                    single_part_md5 = "-" not in etag and head.get('ServerSideEncryption') != 'aws:kms'
+                    if (upload.sha256 and sha256 != upload.sha256) or (single_part_md5 and md5 != etag):
+                        status = SCRUB_HASH_MISMATCH
+
+        if not self._record(upload, status, etag=etag, sha256=sha256):
+            return status  # deleted meanwhile, nothing to report
+        with self._lock:
+            self._checked += 1
+            if status != SCRUB_OK:
+                self._problems[status] += 1
+        if status != SCRUB_OK:
+            logger.warning("scrubber: %s is %s", upload.s3_key, status)
+        return status
+
+    def _hash(self, s3_key: str, size: int) -> tuple[str, str]:
+        """sha256 and md5 of the object, fetched as parallel ranged GETs and hashed in order"""
+        sha256, md5 = hashlib.sha256(), hashlib.md5(usedforsecurity=False)
+        offsets = range(0, size, PART_SIZE)
+        window = self.workers  # ranges in flight ahead of the hasher bounds memory
+        pending = []
+        for offset in offsets:
+            pending.append(self._ranges.submit(self._get_range, s3_key, offset, min(offset + PART_SIZE, size) - 1))
+            if len(pending) >= window:
+                self._update(pending.pop(0).result(), sha256, md5)
+        for future in pending:
+            self._update(future.result(), sha256, md5)
+        with self._lock:
+            self._hashed += 1
+            self._bytes_hashed += size
+        return sha256.hexdigest(), md5.hexdigest()
+
+    @staticmethod
+    def _update(data: bytes, *hashes):
+        for h in hashes:
+            h.update(data)
+
+    def _get_range(self, s3_key: str, start: int, end: int) -> bytes:
+        self._wait(self._bytes, end - start + 1, self._bytes_lock)
+        response = self._s3.get_object(Bucket=self._bucket, Key=s3_key, Range=f"bytes={start}-{end}")
+        return response['Body'].read()
+
+    def _record(self, checked: Upload, status: str, etag: Optional[str], sha256: Optional[str]) -> bool:
+        """Store the result on the row. The ETag (and digest) are only stored for a clean check
+        of the object version the row still describes, so a mismatch or a concurrent tier move
+        never overwrites what the row expects."""
+        with db_manager.get_session() as session:
+            upload = session.get(Upload, checked.id, with_for_update=True)
+            if upload is None:
+                return False
+            upload.scrub_status = status
+            upload.verified_at = datetime.now()
+            unchanged = upload.etag == checked.etag and upload.storage_class == checked.storage_class
+            if status == SCRUB_OK and unchanged:
+                upload.etag = etag
+                if sha256:
+                    upload.sha256 = sha256  # first digest, or unchanged
+            session.add(upload)
+            session.commit()
+            return True
+
+
+# Global instance
+scrubber = Scrubber()
@@ -0,0 +1,89 @@
+"""Production entry point.
+
+    python serve.py migrate   # create missing tables, then exit
+    python serve.py           # migrate once, then run gunicorn with uvicorn workers
+
+Environment:
+    RMI_WORKERS        worker processes (default: CPU count)
+    RMI_BIND           listen address (default: 0.0.0.0:8000)
+    RMI_LOOP           auto | uvloop | asyncio (default: uvloop if installed)
+    RMI_HTTP           auto | httptools | h11 (default: httptools if installed)
+    RMI_SKIP_MIGRATE   1 to start without the migrate step
+    RMI_TIMEOUT        gunicorn worker timeout in seconds (default: 120)
+    RMI_ADMISSION_STATE  file the workers share admission limits through
+                       (default: <tmp>/rmi-admission.db)
+"""
+import os
+import sys
+import tempfile
+import importlib.util
+
+# Workers must not run create_all themselves; migrate() below runs it once in the master
+os.environ["RMI_AUTO_MIGRATE"] = "0"
+# Rate limits and the in-flight bytes cap hold across all workers, not per worker
+os.environ.setdefault("RMI_ADMISSION_STATE", os.path.join(tempfile.gettempdir(), "rmi-admission.db"))
+
+from gunicorn.app.base import BaseApplication
+from uvicorn_worker import UvicornWorker
+
+
+def _pick(name: str, preferred: str) -> str:
+    value = os.getenv(name, "")
+    if value:
+        return value
+    return preferred if importlib.util.find_spec(preferred) else "auto"
+
+
+class TunedUvicornWorker(UvicornWorker):
+    CONFIG_KWARGS = {
+        "loop": _pick("RMI_LOOP", "uvloop"),
+        "http": _pick("RMI_HTTP", "httptools"),
+    }
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # With preload_app this runs once in the master; workers inherit the imported app
+        from app_fastapi import app
+        return app
+
+
+def migrate():
+    import app_fastapi  # noqa: F401 - registers every table model with SQLModel.metadata
+    from db import migrate as run_migrate, build_db_uri
+    run_migrate(build_db_uri())
+
+
+def main(argv: list[str]):
+    command = argv[1] if len(argv) > 1 else "run"
+    if command == "migrate":
+        migrate()
+        return
+    if command != "run":
+        sys.exit(f"usage: {argv[0]} [run|migrate]")
+
+    if os.getenv("RMI_SKIP_MIGRATE", "0") != "1":
+        migrate()
+
+    Server({
+        "bind": os.getenv("RMI_BIND", "0.0.0.0:8000"),
+        "workers": int(os.getenv("RMI_WORKERS") or os.cpu_count() or 1),
+        "worker_class": "serve.TunedUvicornWorker",
+        "preload_app": True,
+        "timeout": int(os.getenv("RMI_TIMEOUT", "120")),
+        "graceful_timeout": 30,  # lets the upload queue park staged files cleanly
+        "keepalive": 5,
+        "accesslog": "-",
+    }).run()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
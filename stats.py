@@ -0,0 +1,198 @@
+import logging
+import threading
+from typing import Optional
+
+from sqlalchemy import func, extract, delete, update, insert
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, SQLModel, Field, select
+
+from db import db_manager
+from models import Upload
+
+logger = logging.getLogger(__name__)
+
+GROUP_COLUMNS = ("language", "file_type", "status", "month")
+
+
+# Summary table: one row per (language, file_type, status, month of date_added).
+# Kept in step with Upload by apply() inside the same transaction as the upload/delete,
+# and corrected by recompute() against a full aggregate of Upload to fix any drift.
+# language/file_type are as long as the Upload columns they copy (VARCHAR(255)).
+class UploadStat(SQLModel, table=True):
+    language: str = Field(primary_key=True, max_length=255)
+    file_type: str = Field(primary_key=True, max_length=255)
+    status: int = Field(primary_key=True)
+    month: str = Field(primary_key=True, max_length=7)  # "YYYY-MM"
+    files: int = 0
+    total_size: int = 0  # bytes
+
+
+def _key(upload: Upload, status: Optional[int] = None) -> dict:
+    return {
+        "language": upload.language or "",
+        "file_type": upload.file_type or "",
+        "status": upload.status if status is None else status,
+        "month": upload.date_added.strftime("%Y-%m"),
+    }
+
+
+def _upsert(session: Session, key: dict, files: int, total_size: int):
+    """Atomic increment; INSERT ... ON DUPLICATE KEY / ON CONFLICT so concurrent uploads
+    into a new group don't collide on the primary key"""
+    values = {**key, "files": files, "total_size": total_size}
+    table = UploadStat.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql.insert(table).values(**values)
+        stmt = stmt.on_duplicate_key_update(
+            files=table.c.files + files,
+            total_size=table.c.total_size + total_size,
+        )
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key),
+            set_={"files": table.c.files + files, "total_size": table.c.total_size + total_size},
+        )
+    else:
+        _update_or_insert(session, key, files, total_size)
+        return
+    session.execute(stmt)
+
+
+def _update_or_insert(session: Session, key: dict, files: int, total_size: int):
+    """Portable upsert: increment the row, create it if missing; a concurrent insert of the
+    same group makes ours fail, after which the increment finds the row"""
+    table = UploadStat.__table__
+    where = [table.c[name] == value for name, value in key.items()]
+    increment = update(table).where(*where).values(
+        files=table.c.files + files,
+        total_size=table.c.total_size + total_size,
+    )
+    if session.execute(increment).rowcount:
+        return
+    try:
+        with session.begin_nested():
+            session.execute(insert(table).values(**key, files=files, total_size=total_size))
+    except IntegrityError:
+        session.execute(increment)
+
+
+def apply(session: Session, upload: Upload, sign: int = 1):
+    """Count an inserted (sign=1) or deleted (sign=-1) upload; caller commits"""
+    _upsert(session, _key(upload), sign, sign * upload.size)
+
+
+def move(session: Session, upload: Upload, old_status: int):
+    """Move an upload between status groups after its status changed; caller commits"""
+    if old_status == upload.status:
+        return
+    _upsert(session, _key(upload, old_status), -1, -upload.size)
+    _upsert(session, _key(upload), 1, upload.size)
+
+
+def recompute(session: Session) -> int:
+    """Correct the summary table against an aggregate of Upload; returns the number of
+    groups changed.
+
+    Rather than rebuilding the table (which would drop increments committed by uploads
+    between reading Upload and writing the table), both tables are read in one transaction
+    (one snapshot on MySQL InnoDB's REPEATABLE READ) and only the differences are applied,
+    as atomic increments on top of whatever concurrent uploads have added since.
+    """
+    year = extract("year", Upload.date_added)
+    month = extract("month", Upload.date_added)
+    statement = (
+        select(Upload.language, Upload.file_type, Upload.status, year, month,
+               func.count(), func.coalesce(func.sum(Upload.size), 0))
+        .group_by(Upload.language, Upload.file_type, Upload.status, year, month)
+    )
+    rows = session.exec(statement).all()
+
+    # NULL and "" language/file_type fold into the same key, so merge as we go
+    groups: dict[tuple, list[int]] = {}
+    for language, file_type, status, y, m, files, total_size in rows:
+        key = (language or "", file_type or "", status, f"{int(y):04d}-{int(m):02d}")
+        group = groups.setdefault(key, [0, 0])
+        group[0] += files
+        group[1] += int(total_size)
+
+    for stat in session.exec(select(UploadStat)).all():
+        group = groups.setdefault((stat.language, stat.file_type, stat.status, stat.month), [0, 0])
+        group[0] -= stat.files
+        group[1] -= stat.total_size
+
+    changed = 0
+    for key, (files, total_size) in groups.items():
+        if files or total_size:
+            _upsert(session, dict(zip(GROUP_COLUMNS, key)), files, total_size)
+            changed += 1
+    # emptied groups; conditional, so a group an upload just re-filled stays
+    session.execute(delete(UploadStat).where(UploadStat.files == 0, UploadStat.total_size == 0))
+    session.commit()
+    return changed
+
+
+def query(session: Session, group_by: list[str]) -> list[dict]:
+    """Totals grouped by any subset of GROUP_COLUMNS, read from the summary table only"""
+    columns = [getattr(UploadStat, name) for name in group_by]
+    statement = (
+        select(*columns, func.sum(UploadStat.files), func.sum(UploadStat.total_size))
+        .where(UploadStat.files > 0)
+        .group_by(*columns)
+        .order_by(*columns)
+    )
+    result = []
+    for row in session.exec(statement).all():
+        *values, files, total_size = row
+        group = dict(zip(group_by, values))
+        group["files"] = int(files)
+        group["total_size"] = int(total_size)
+        result.append(group)
+    return result
+
+
+class StatsRecomputer:
+    """Background thread running recompute() every `interval` seconds"""
+
+    def __init__(self):
+        self.enabled = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, interval: float = 3600.0):
+        self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stats-recompute", daemon=True)
+        self._thread.start()
+        self.enabled = True
+
+    def stop(self, timeout: float = 10.0):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            # Fill the table right away on first deployment instead of waiting an interval
+            with db_manager.get_session() as session:
+                if session.exec(select(UploadStat).limit(1)).first() is None:
+                    recompute(session)
+        except Exception:
+            logger.exception("stats: initial recompute failed")
+
+        while not self._stop.wait(self.interval):
+            try:
+                with db_manager.get_session() as session:
+                    changed = recompute(session)
+                if changed:
+                    logger.info("stats: corrected %d drifted groups", changed)
+            except Exception:
+                logger.exception("stats: recompute failed")
+
+
+# Global instance
+stats_recomputer = StatsRecomputer()
@@ -0,0 +1,213 @@
+import logging
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from typing import BinaryIO, Iterator, Optional
+
+from sqlmodel import select, or_, and_
+
+from db import db_manager
+from models import Upload, NOT_IN_S3
+
+logger = logging.getLogger(__name__)
+
+# Only classes that still serve GetObject immediately; GLACIER/DEEP_ARCHIVE need a restore
+# before /download works, so they are not allowed as tiering targets.
+TIER_ORDER = ["STANDARD", "INTELLIGENT_TIERING", "STANDARD_IA", "ONEZONE_IA", "GLACIER_IR"]
+
+# S3 bills IA/Glacier IR objects as at least 128 KB, so moving smaller ones costs more
+MIN_TIERING_SIZE = 128 * 1024
+
+
+class StoragePolicy:
+    """Decides how an upload is encoded in S3 (zstd for compressible file types)"""
+
+    def __init__(self):
+        self.compress_types: set[str] = set()
+        self.level = 10
+        self.min_size = 4096
+        self.min_saving = 0.1  # keep the compressed copy only if it saves at least 10%
+
+    def configure(self, compress_types: set[str], level: int = 10, min_size: int = 4096, min_saving: float = 0.1):
+        self.compress_types = compress_types
+        self.level = level
+        self.min_size = min_size
+        self.min_saving = min_saving
+
+    def prepare(self, fileobj: BinaryIO, file_type: str, size: int) -> tuple[BinaryIO, Optional[str], int]:
+        """Return (body to store, content encoding or None, stored size)"""
+        if file_type not in self.compress_types or size < self.min_size:
+            return fileobj, None, size
+
+        import zstandard  # only needed when compression is enabled
+
+        compressed = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        zstandard.ZstdCompressor(level=self.level).copy_stream(fileobj, compressed, size=size)
+        stored_size = compressed.tell()
+        fileobj.seek(0)
+
+        if stored_size > size * (1 - self.min_saving):
+            compressed.close()
+            return fileobj, None, size
+
+        compressed.seek(0)
+        return compressed, "zstd", stored_size
+
+    @staticmethod
+    def decompress(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+        """Decode a stored body chunk by chunk, without buffering the whole object"""
+        if encoding != "zstd":
+            raise ValueError(f"Unsupported content encoding: {encoding}")
+
+        import zstandard
+
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+
+
+class StorageTierer:
+    """Background thread moving objects that haven't been downloaded lately to cheaper storage classes"""
+
+    def __init__(self):
+        self.enabled = False
+        self.rules: list[tuple[int, str]] = []  # (idle days, storage class), ascending
+        self._s3 = None
+        self._bucket: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def parse_rules(spec: str) -> list[tuple[int, str]]:
+        """Parse "STANDARD_IA:30,GLACIER_IR:180" into [(30, "STANDARD_IA"), (180, "GLACIER_IR")]"""
+        rules = []
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            storage_class, days = item.split(":")
+            storage_class = storage_class.strip().upper()
+            if storage_class not in TIER_ORDER[1:]:
+                raise ValueError(f"Unsupported tiering storage class: {storage_class}")
+            rules.append((int(days), storage_class))
+        return sorted(rules)
+
+    def start(self, s3_client, bucket: str, rules: list[tuple[int, str]], interval: float = 3600.0, batch_size: int = 100):
+        self._s3 = s3_client
+        self._bucket = bucket
+        self.rules = rules
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="storage-tierer", daemon=True)
+        self._thread.start()
+        self.enabled = True
+
+    def stop(self, timeout: float = 10.0):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                moved = self.run_once()
+                if moved:
+                    logger.info("storage tierer: moved %d objects", moved)
+            except Exception:
+                logger.exception("storage tierer: pass failed")
+            self._stop.wait(self.interval)
+
+    def run_once(self) -> int:
+        """Apply every rule once, coldest first; returns the number of objects moved"""
+        moved = 0
+        now = datetime.now()
+        # Coldest rule first so an object idle for 200 days goes straight to GLACIER_IR
+        for days, storage_class in reversed(self.rules):
+            warmer = TIER_ORDER[:TIER_ORDER.index(storage_class)]
+            cutoff = now - timedelta(days=days)
+            last_id = ""
+            while not self._stop.is_set():
+                with db_manager.get_session() as session:
+                    statement = (
+                        select(Upload)
+                        .where(
+                            Upload.id > last_id,
+                            or_(Upload.storage_class.in_(warmer), Upload.storage_class == None),  # noqa: E711
+                            Upload.status.not_in(NOT_IN_S3),
+                            or_(Upload.stored_size >= MIN_TIERING_SIZE,
+                                and_(Upload.stored_size == None, Upload.size >= MIN_TIERING_SIZE)),  # noqa: E711
+                            or_(Upload.last_accessed < cutoff,
+                                and_(Upload.last_accessed == None, Upload.date_added < cutoff)),  # noqa: E711
+                        )
+                        .order_by(Upload.id)
+                        .limit(self.batch_size)
+                    )
+                    batch = session.exec(statement).all()
+                    if not batch:
+                        break
+                    last_id = batch[-1].id
+                    for upload in batch:
+                        try:
+                            self._move(upload.s3_key, storage_class)
+                        except Exception as e:
+                            logger.warning("storage tierer: could not move %s: %s", upload.s3_key, e)
+                            continue
+                        upload.storage_class = storage_class
+                        upload.etag = None  # a (multipart) copy gets a new ETag; the scrubber re-records it
+                        session.add(upload)
+                        session.commit()
+                        moved += 1
+        return moved
+
+    def _move(self, s3_key: str, storage_class: str):
+        # In-place copy changes the storage class; managed copy handles objects over 5 GB
+        self._s3.copy(
+            {'Bucket': self._bucket, 'Key': s3_key},
+            self._bucket,
+            s3_key,
+            ExtraArgs={
+                'StorageClass': storage_class,
+                'MetadataDirective': 'COPY'
+            }
+        )
+
+
+# Global instances
+storage_policy = StoragePolicy()
+storage_tierer = StorageTierer()
+
+
+def touch(upload: Upload, min_interval: timedelta = timedelta(hours=1)) -> bool:
+    """Record an access for tiering; skips the write if the last one is recent"""
+    now = datetime.now()
+    if upload.last_accessed and now - upload.last_accessed < min_interval:
+        return False
+    upload.last_accessed = now
+    return True
+
+
+def accepts_encoding(header: Optional[str], encoding: str) -> bool:
+    """Whether an Accept-Encoding header lets us send `encoding` as is: listed (or covered
+    by `*`) with a non-zero q-value, so "zstd;q=0" refuses it"""
+    if not header:
+        return False
+    encoding = encoding.lower()
+    wildcard = False
+    for item in header.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        coding = coding.lower()
+        if coding == encoding:
+            return q > 0  # an explicit entry wins over `*`
+        if coding == "*":
+            wildcard = q > 0
+    return wildcard
@@ -0,0 +1,208 @@
+import asyncio
+import subprocess
+import sys
+
+import pytest
+
+import admission as admission_module
+from admission import AdmissionController, AdmissionMiddleware, InMemoryBackend, SharedBackend, Throttled, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def controller(**config) -> AdmissionController:
+    controller = AdmissionController(InMemoryBackend())
+    controller.configure(**config)
+    controller.poll_interval = 0.01
+    return controller
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+# ====== Token bucket ======
+def test_token_bucket_burst_then_refill(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission_module.time, "monotonic", clock)
+    bucket = TokenBucket(rate=2.0, burst=3.0)
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take() == pytest.approx(0.5)  # one token at 2/s
+    clock.now += 0.5
+    assert bucket.take() == 0.0
+    clock.now += 100
+    assert [bucket.take() for _ in range(4)][-1] > 0  # refills up to burst only
+
+
+def test_backend_buckets_are_per_client(monkeypatch):
+    monkeypatch.setattr(admission_module.time, "monotonic", Clock())
+    backend = InMemoryBackend()
+    assert backend.take_token("a", 1.0, 1.0) == 0.0
+    assert backend.take_token("a", 1.0, 1.0) > 0
+    assert backend.take_token("b", 1.0, 1.0) == 0.0
+
+
+def test_backend_reserve_and_release():
+    backend = InMemoryBackend()
+    assert backend.reserve_bytes(60, 100)
+    assert not backend.reserve_bytes(60, 100)
+    backend.release_bytes(60)
+    assert backend.reserve_bytes(500, 100)  # oversized runs, but only alone
+    assert not backend.reserve_bytes(1, 100)
+    backend.release_bytes(500)
+    assert backend.in_flight_bytes() == 0
+
+
+def test_shared_backend_limits_span_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(admission_module.time, "monotonic", Clock())
+    path = str(tmp_path / "admission.db")
+    worker_a, worker_b = SharedBackend(path), SharedBackend(path)
+    worker_b._pid += 1  # stands in for another worker process
+    assert worker_a.reserve_bytes(60, 100)
+    assert not worker_b.reserve_bytes(60, 100)
+    assert worker_b.in_flight_bytes() == 60
+    worker_a.release_bytes(60)
+    assert worker_b.reserve_bytes(60, 100)
+    assert worker_a.take_token("a", 1.0, 1.0) == 0.0
+    assert worker_b.take_token("a", 1.0, 1.0) > 0  # one bucket per client, not per worker
+
+
+def test_shared_backend_drops_reservations_of_dead_workers(tmp_path):
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                          capture_output=True, text=True, check=True)
+    path = str(tmp_path / "admission.db")
+    crashed = SharedBackend(path)
+    crashed._pid = int(dead.stdout)
+    assert crashed.reserve_bytes(100, 100)  # never released
+
+    backend = SharedBackend(path)
+    assert backend.reserve_bytes(40, 100)
+    assert backend.in_flight_bytes() == 40
+
+
+def test_rate_limit_rejects_past_max_wait():
+    async def run():
+        limited = controller(rate=1.0, burst=1.0, max_wait=0.0)
+        await limited.acquire("a", 0)
+        with pytest.raises(Throttled) as raised:
+            await limited.acquire("a", 0)
+        assert raised.value.reason == "rate" and raised.value.retry_after > 0
+        await limited.acquire("b", 0)  # other clients have their own bucket
+        assert limited.metrics().throttled_rate == 1
+
+    asyncio.run(run())
+
+
+# ====== Fair queueing ======
+def test_dispatch_is_round_robin_across_clients():
+    async def run():
+        fair = controller(max_inflight_bytes=100, max_wait=5.0)
+        held = await fair.acquire("x", 100)
+        order = []
+
+        async def request(client, name):
+            reserved = await fair.acquire(client, 100)
+            order.append(name)
+            return reserved
+
+        tasks = [asyncio.create_task(request("a", f"a{i}")) for i in range(3)]
+        await settle()
+        tasks.append(asyncio.create_task(request("b", "b0")))
+        await settle()
+        assert fair.metrics().queued_now == 4
+
+        fair.release(held)
+        for _ in tasks:
+            await settle()
+            fair.release(100)  # the request admitted last finishes, the next one gets in
+        assert await asyncio.gather(*tasks) == [100] * 4
+        assert order == ["a0", "b0", "a1", "a2"]
+        assert fair.backend.in_flight_bytes() == 0
+        assert fair.metrics().queued == 4
+
+    asyncio.run(run())
+
+
+def test_queued_request_is_removed_on_cancel():
+    async def run():
+        fair = controller(max_inflight_bytes=100, max_wait=5.0)
+        held = await fair.acquire("x", 100)
+        task = asyncio.create_task(fair.acquire("a", 50))
+        await settle()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert fair.metrics().queued_now == 0
+        fair.release(held)
+        assert fair.backend.in_flight_bytes() == 0
+
+    asyncio.run(run())
+
+
+def test_cancel_after_admission_releases_the_bytes():
+    async def run():
+        fair = controller(max_inflight_bytes=100, max_wait=5.0)
+        held = await fair.acquire("x", 100)
+        task = asyncio.create_task(fair.acquire("a", 80))
+        await settle()
+        fair.release(held)  # dispatch reserves 80 bytes for the waiter...
+        assert fair.backend.in_flight_bytes() == 80
+        task.cancel()  # ...which is cancelled before it resumes
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert fair.backend.in_flight_bytes() == 0
+
+    asyncio.run(run())
+
+
+def test_queued_request_times_out_with_429():
+    async def run():
+        fair = controller(max_inflight_bytes=100, max_wait=0.05)
+        held = await fair.acquire("x", 100)
+        with pytest.raises(Throttled) as raised:
+            await fair.acquire("a", 10)
+        assert raised.value.reason == "bytes"
+        assert fair.metrics().queued_now == 0 and fair.metrics().throttled_bytes == 1
+        fair.release(held)
+        assert fair.backend.in_flight_bytes() == 0
+
+    asyncio.run(run())
+
+
+# ====== Middleware ======
+def test_middleware_releases_bytes_when_the_app_fails():
+    async def failing_app(scope, receive, send):
+        assert fair.backend.in_flight_bytes() == 40
+        raise RuntimeError("boom")
+
+    fair = controller(max_inflight_bytes=100)
+    middleware = AdmissionMiddleware(failing_app, fair, {"/upload": lambda scope: 40})
+    scope = {"type": "http", "path": "/upload", "headers": [], "client": ("1.2.3.4", 1)}
+    with pytest.raises(RuntimeError):
+        asyncio.run(middleware(scope, None, None))
+    assert fair.backend.in_flight_bytes() == 0
+
+
+def test_middleware_answers_429_when_throttled():
+    sent = []
+
+    async def app(scope, receive, send):
+        raise AssertionError("throttled requests must not reach the app")
+
+    async def send(message):
+        sent.append(message)
+
+    limited = controller(rate=1.0, burst=1.0, max_wait=0.0)
+    middleware = AdmissionMiddleware(app, limited, {"/delete": lambda scope: 0})
+    scope = {"type": "http", "path": "/delete/a/b.pdf", "headers": [(b"x-api-key", b"k")]}
+    asyncio.run(limited.acquire("key:k", 0))
+    asyncio.run(middleware(scope, None, send))
+    assert sent[0]["status"] == 429
+    assert (b"retry-after", b"1") in sent[0]["headers"]
@@ -0,0 +1,107 @@
+import io
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from columnar import query_sheet
+
+KEY = "a" * 32 + "/_derived/sheets/0.parquet"
+GROUP_ROWS = 25
+
+
+class Body:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def read(self) -> bytes:
+        return self.data
+
+
+class FakeS3:
+    """Serves one object, honouring Range headers"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.data)}
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = Range[len("bytes="):].split("-")
+        return {"Body": Body(self.data[int(start):int(end) + 1])}
+
+
+@pytest.fixture(scope="module")
+def s3():
+    # 100 rows in 4 row groups of 25, with min/max statistics
+    table = pa.table({
+        "id": list(range(100)),
+        "amount": [i * 1.5 for i in range(100)],
+        "region": ["north" if i % 2 else "south" for i in range(100)],
+    })
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, row_group_size=GROUP_ROWS, write_statistics=True)
+    return FakeS3(buffer.getvalue())
+
+
+def ids(result):
+    return [row["id"] for row in result["rows"]]
+
+
+def test_columns_and_limit(s3):
+    result = query_sheet(s3, "bucket", KEY, columns=["region", "id"], limit=3)
+    assert result["columns"] == ["region", "id"]
+    assert result["rows"] == [{"region": "south", "id": 0}, {"region": "north", "id": 1},
+                              {"region": "south", "id": 2}]
+    assert result["total_rows"] == 100
+
+
+@pytest.mark.parametrize("offset, limit, expected", [
+    (20, 10, list(range(20, 30))),  # spans the first two groups
+    (50, 30, list(range(50, 80))),  # starts on a group boundary, skips two groups unread
+    (95, 10, list(range(95, 100))),
+    (100, 10, []),
+])
+def test_offset_across_row_groups(s3, offset, limit, expected):
+    assert ids(query_sheet(s3, "bucket", KEY, columns=["id"], offset=offset, limit=limit)) == expected
+
+
+def test_offset_skips_groups_without_reading_them(s3):
+    every_group = query_sheet(s3, "bucket", KEY, columns=["id"], offset=0, limit=100)
+    last_group = query_sheet(s3, "bucket", KEY, columns=["id"], offset=75, limit=5)
+    assert ids(last_group) == list(range(75, 80))
+    assert last_group["bytes_read"] < every_group["bytes_read"]
+
+
+def test_filter_then_offset_counts_matching_rows(s3):
+    result = query_sheet(s3, "bucket", KEY, columns=["id"], filters=["region==north", "id>=20"],
+                         offset=3, limit=4)
+    assert ids(result) == [27, 29, 31, 33]  # odd ids from 21, skipping 21, 23, 25
+
+
+def test_filter_on_a_float_column(s3):
+    result = query_sheet(s3, "bucket", KEY, columns=["id", "amount"], filters=["amount<3"])
+    assert result["rows"] == [{"id": 0, "amount": 0.0}, {"id": 1, "amount": 1.5}]
+
+
+def test_statistics_prune_row_groups(s3):
+    full = query_sheet(s3, "bucket", KEY, filters=["id>=0"], limit=100)
+    pruned = query_sheet(s3, "bucket", KEY, filters=["id>=90"], limit=100)
+    assert ids(full) == list(range(100))
+    assert ids(pruned) == list(range(90, 100))
+    assert pruned["bytes_read"] < full["bytes_read"]
+    nothing = query_sheet(s3, "bucket", KEY, filters=["id>1000"])
+    assert nothing["rows"] == [] and nothing["bytes_read"] < pruned["bytes_read"]
+
+
+@pytest.mark.parametrize("columns, filters", [
+    (["id", "missing"], None),
+    (None, ["missing==1"]),
+    (None, ["id>=abc"]),  # not an integer
+    (None, ["amount<lots"]),
+    (None, ["id"]),  # no operator
+])
+def test_bad_queries_raise_value_error(s3, columns, filters):
+    with pytest.raises(ValueError):
+        query_sheet(s3, "bucket", KEY, columns=columns, filters=filters)
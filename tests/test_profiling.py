@@ -0,0 +1,38 @@
+import sys
+import threading
+
+import profiling
+from profiling import Profiler, fold
+
+
+def here():
+    return sys._getframe()
+
+
+def test_fold_is_root_first_and_tracks_lines():
+    stacks = [fold(here(), "main") for _ in range(2)]
+    assert stacks[0] == stacks[1]  # same call site, cached stack
+    assert stacks[0].startswith("main;")
+    assert stacks[0].endswith(f"here (test_profiling.py:{here.__code__.co_firstlineno + 1})")
+
+    other_line = fold(here(), "main")
+    assert other_line != stacks[0]
+    assert other_line.split(";")[:-2] == stacks[0].split(";")[:-2]
+
+
+def test_fold_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(profiling, "MAX_CACHED_STACKS", 2)
+    for i in range(5):
+        fold(here(), f"thread-{i}")
+    assert len(profiling._folded) <= 2
+
+
+def test_sample_sees_waiting_threads():
+    release = threading.Event()
+    waiter = threading.Thread(target=release.wait, name="waiter", daemon=True)
+    waiter.start()
+    try:
+        stacks = Profiler().sample(0.05)
+    finally:
+        release.set()
+    assert any(stack.startswith("waiter;") and "wait (threading.py" in stack for stack in stacks)
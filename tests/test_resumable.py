@@ -0,0 +1,184 @@
+import io
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, create_engine, select
+
+import resumable
+from db import db_manager
+from models import Upload, STATUS_UPLOADED
+from resumable import ResumableUploads, UploadConflict, STATE_COMPLETE
+from stats import UploadStat
+
+
+def no_such_upload(operation):
+    return ClientError({"Error": {"Code": "NoSuchUpload"}}, operation)
+
+
+class FakeS3:
+    """Just enough of the multipart API, keeping parts and objects in memory"""
+
+    def __init__(self):
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.objects: dict[str, bytes] = {}
+        self.on_upload_part = None  # hook run before a part is stored
+
+    def create_multipart_upload(self, Bucket, Key, ContentType, Metadata):
+        upload_id = f"mpu-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentLength, ContentMD5=None):
+        if self.on_upload_part is not None:
+            hook, self.on_upload_part = self.on_upload_part, None
+            hook()
+        self.uploads[UploadId][PartNumber] = Body.read(ContentLength)
+        return {"ETag": f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        if UploadId not in self.uploads:
+            raise no_such_upload("CompleteMultipartUpload")
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        if self.uploads.pop(UploadId, None) is None:
+            raise no_such_upload("AbortMultipartUpload")
+
+    def put_object(self, Bucket, Key, Body, ContentType, Metadata):
+        self.objects[Key] = Body
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[Key])}
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+@pytest.fixture
+def uploads(s3, monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(db_manager, "engine", engine)
+    monkeypatch.setattr(resumable, "MIN_CHUNK_SIZE", 4)
+    uploads = ResumableUploads()
+    uploads.configure(s3, "bucket")
+    return uploads
+
+
+def write(uploads, offset, data, upload_id="upload-1"):
+    return uploads.write_chunk(upload_id, offset, io.BytesIO(data), len(data))
+
+
+def part_numbers(record):
+    return [part["PartNumber"] for part in json.loads(record.parts)]
+
+
+def test_chunks_commit_in_order_and_complete(uploads, s3):
+    uploads.create("upload-1", "report.pdf", 10, "application/pdf", filename="Report")
+    for offset, data in ((0, b"abcd"), (4, b"efgh"), (8, b"ij")):
+        record = write(uploads, offset, data)
+    assert record.offset == 10 and part_numbers(record) == [1, 2, 3]
+
+    record, upload, created = uploads.complete("upload-1")
+    assert created and record.state == STATE_COMPLETE
+    assert s3.objects[upload.s3_key] == b"abcdefghij"
+    assert (upload.id, upload.size, upload.status, upload.filename) == (record.file_id, 10, STATUS_UPLOADED, "Report")
+
+
+def test_wrong_offset_conflicts_with_the_committed_offset(uploads):
+    uploads.create("upload-1", "report.pdf", 10, "application/pdf")
+    write(uploads, 0, b"abcd")
+    for offset in (0, 8):
+        with pytest.raises(UploadConflict) as conflict:
+            write(uploads, offset, b"efgh")
+        assert conflict.value.offset == 4
+
+
+def test_chunk_size_limits(uploads):
+    uploads.create("upload-1", "report.pdf", 10, "application/pdf")
+    with pytest.raises(ValueError):
+        write(uploads, 0, b"abc")  # short, but not the last chunk
+    write(uploads, 0, b"abcd")
+    with pytest.raises(ValueError):
+        write(uploads, 4, b"efghijk")  # past the declared length
+    assert uploads.get("upload-1").offset == 4
+
+
+def test_retried_chunk_gets_a_fresh_part_number(uploads, s3):
+    uploads.create("upload-1", "report.pdf", 8, "application/pdf")
+
+    def broken_connection():
+        raise ConnectionError("reset by peer")
+
+    s3.on_upload_part = broken_connection
+    with pytest.raises(ConnectionError):
+        write(uploads, 0, b"abcd")
+    assert uploads.get("upload-1").offset == 0
+
+    assert part_numbers(write(uploads, 0, b"abcd")) == [2]
+    assert part_numbers(write(uploads, 4, b"efgh")) == [2, 3]
+    _, upload, _ = uploads.complete("upload-1")
+    assert s3.objects[upload.s3_key] == b"abcdefgh"
+
+
+def test_concurrent_writer_of_the_same_offset_loses(uploads, s3):
+    uploads.create("upload-1", "report.pdf", 8, "application/pdf")
+    # another request sends the same chunk while ours is being uploaded, and commits first
+    s3.on_upload_part = lambda: write(uploads, 0, b"WXYZ")
+    with pytest.raises(UploadConflict) as conflict:
+        write(uploads, 0, b"abcd")
+    assert conflict.value.offset == 4
+
+    record = write(uploads, 4, b"efgh")
+    assert part_numbers(record) == [2, 3]  # the loser's part 1 is never listed
+    _, upload, _ = uploads.complete("upload-1")
+    assert s3.objects[upload.s3_key] == b"WXYZefgh"
+
+
+def test_complete_before_all_bytes_conflicts(uploads):
+    uploads.create("upload-1", "report.pdf", 8, "application/pdf")
+    write(uploads, 0, b"abcd")
+    with pytest.raises(UploadConflict) as conflict:
+        uploads.complete("upload-1")
+    assert conflict.value.offset == 4
+
+
+def test_complete_is_idempotent(uploads):
+    uploads.create("upload-1", "report.pdf", 4, "application/pdf")
+    write(uploads, 0, b"abcd")
+    _, first, created = uploads.complete("upload-1")
+    _, again, created_again = uploads.complete("upload-1")
+    assert created and not created_again
+    assert (again.id, again.s3_key) == (first.id, first.s3_key)
+    with db_manager.get_session() as session:
+        assert len(session.exec(select(Upload)).all()) == 1
+        assert sum(stat.files for stat in session.exec(select(UploadStat)).all()) == 1
+    with pytest.raises(UploadConflict):
+        write(uploads, 4, b"more")
+
+
+def test_complete_after_crash_between_s3_and_commit(uploads, s3):
+    record = uploads.create("upload-1", "report.pdf", 4, "application/pdf")
+    write(uploads, 0, b"abcd")
+    # S3 completed the upload, then the process died before the row was updated
+    s3.complete_multipart_upload(Bucket="bucket", Key=record.s3_key, UploadId=record.s3_upload_id,
+                                 MultipartUpload={"Parts": [{"PartNumber": 1, "ETag": '"etag-1"'}]})
+
+    _, upload, created = uploads.complete("upload-1")
+    assert created and (upload.id, upload.s3_key) == (record.file_id, record.s3_key)
+    _, again, created_again = uploads.complete("upload-1")
+    assert not created_again and (again.id, again.s3_key) == (upload.id, upload.s3_key)
+
+
+def test_zero_length_upload_is_stored_directly(uploads, s3):
+    record = uploads.create("upload-1", "empty.pdf", 0, "application/pdf")
+    assert write(uploads, 0, b"").offset == 0
+    _, upload, created = uploads.complete("upload-1")
+    assert created and upload.size == 0
+    assert s3.objects[record.s3_key] == b""
+    assert record.s3_upload_id not in s3.uploads  # the multipart upload was aborted
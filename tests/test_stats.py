@@ -0,0 +1,64 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, select
+
+import stats
+from models import Upload, STATUS_UPLOADED, STATUS_PROCESSED
+from stats import UploadStat
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def add_upload(session, file_id, size, language="en", status=STATUS_UPLOADED):
+    upload = Upload(id=file_id, filename=file_id, author="", language=language, size=size,
+                    file_type="pdf", source_filename=f"{file_id}.pdf", pages=0, status=status,
+                    s3_key=f"{file_id}/{file_id}.pdf", date_added=datetime(2025, 3, 1))
+    session.add(upload)
+    stats.apply(session, upload)
+    session.commit()
+    return upload
+
+
+def table(session):
+    return {(s.language, s.status): (s.files, s.total_size) for s in session.exec(select(UploadStat)).all()}
+
+
+def test_apply_and_move(session):
+    upload = add_upload(session, "a", 10)
+    add_upload(session, "b", 5)
+    upload.status = STATUS_PROCESSED
+    stats.move(session, upload, STATUS_UPLOADED)
+    session.commit()
+    assert table(session) == {("en", STATUS_UPLOADED): (1, 5), ("en", STATUS_PROCESSED): (1, 10)}
+    assert stats.query(session, ["language"]) == [{"language": "en", "files": 2, "total_size": 15}]
+
+
+def test_recompute_corrects_drift_in_place(session):
+    add_upload(session, "a", 10)
+    add_upload(session, "b", 5, language="de")
+    # drift: a wrong count, a group with no uploads, a missing group
+    session.get(UploadStat, ("en", "pdf", STATUS_UPLOADED, "2025-03")).files = 7
+    session.add(UploadStat(language="fr", file_type="pdf", status=STATUS_UPLOADED, month="2025-03",
+                           files=2, total_size=4))
+    session.delete(session.get(UploadStat, ("de", "pdf", STATUS_UPLOADED, "2025-03")))
+    session.commit()
+
+    assert stats.recompute(session) == 3
+    assert table(session) == {("en", STATUS_UPLOADED): (1, 10), ("de", STATUS_UPLOADED): (1, 5)}
+    assert stats.recompute(session) == 0
+
+
+def test_update_or_insert_fallback(session):
+    key = {"language": "en", "file_type": "pdf", "status": STATUS_UPLOADED, "month": "2025-03"}
+    stats._update_or_insert(session, key, 1, 10)
+    stats._update_or_insert(session, key, 2, 5)
+    session.commit()
+    assert table(session) == {("en", STATUS_UPLOADED): (3, 15)}
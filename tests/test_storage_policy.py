@@ -0,0 +1,23 @@
+import pytest
+
+from storage_policy import accepts_encoding
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("zstd", True),
+    ("gzip, deflate, br, zstd", True),
+    ("ZSTD;q=0.5", True),
+    ("gzip, zstd ; q=1.0", True),
+    ("zstd;q=0", False),
+    ("zstd;q=0.000", False),
+    ("gzip, zstd;q=0, *", False),  # explicit refusal wins over the wildcard
+    ("*", True),
+    ("*;q=0", False),
+    ("gzip, br", False),
+    ("x-zstd-ish", False),  # no substring matches
+    ("zstd;q=oops", False),
+    ("", False),
+    (None, False),
+])
+def test_accepts_encoding(header, expected):
+    assert accepts_encoding(header, "zstd") is expected
@@ -0,0 +1,173 @@
+import io
+import os
+import time
+from datetime import datetime
+
+import pytest
+from sqlmodel import SQLModel, create_engine, select
+
+import stats
+from db import db_manager
+from models import Upload, STATUS_PENDING, STATUS_UPLOADED, STATUS_FAILED
+from stats import UploadStat
+from upload_queue import UploadQueue
+
+FILE_ID = "a" * 32
+S3_KEY = f"{FILE_ID}/report.pdf"
+
+
+class FakeS3:
+    def __init__(self, failures: int = 0):
+        self.failures = failures  # upload_file calls that fail before one succeeds
+        self.objects: dict[str, tuple[bytes, dict]] = {}
+        self.calls = 0
+
+    def upload_file(self, path, bucket, key, ExtraArgs):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("S3 unreachable")
+        with open(path, "rb") as f:
+            self.objects[key] = (f.read(), ExtraArgs)
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(db_manager, "engine", engine)
+
+
+@pytest.fixture
+def staging(tmp_path):
+    return str(tmp_path / "staging")
+
+
+@pytest.fixture
+def queues():
+    started = []
+    yield started
+    for upload_queue in started:
+        upload_queue.stop()
+
+
+def start(queues, s3, staging, **options) -> UploadQueue:
+    upload_queue = UploadQueue()
+    upload_queue.start(s3, "bucket", staging, workers=1, **options)
+    queues.append(upload_queue)
+    return upload_queue
+
+
+def crashed_request(staging, insert_row=True) -> UploadQueue:
+    """A process that staged an upload (and committed its pending row), then died"""
+    os.makedirs(staging, exist_ok=True)
+    upload_queue = UploadQueue()
+    upload_queue.staging_dir = staging
+    upload_queue.stage(io.BytesIO(b"%PDF-1.7 body"), FILE_ID, S3_KEY, "application/pdf", "zstd")
+    if insert_row:
+        add_pending_row()
+    for fd in upload_queue._locks.values():
+        os.close(fd)  # the kernel drops the flocks of a dead process
+    return upload_queue
+
+
+def add_pending_row():
+    with db_manager.get_session() as session:
+        upload = Upload(id=FILE_ID, filename="Report", author="", language="en", size=13,
+                        file_type="pdf", source_filename="report.pdf", pages=0,
+                        status=STATUS_PENDING, s3_key=S3_KEY, date_added=datetime(2025, 3, 1))
+        session.add(upload)
+        stats.apply(session, upload)
+        session.commit()
+
+
+def status():
+    with db_manager.get_session() as session:
+        upload = session.get(Upload, FILE_ID)
+        return upload.status if upload else None
+
+
+def stat_statuses():
+    with db_manager.get_session() as session:
+        return {stat.status: stat.files for stat in session.exec(select(UploadStat)).all()}
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def staged_files(staging):
+    return sorted(name for name in os.listdir(staging) if name != "failed")
+
+
+def test_staged_upload_survives_a_restart(queues, staging):
+    crashed_request(staging)
+    s3 = FakeS3()
+    upload_queue = start(queues, s3, staging)
+
+    wait_for(lambda: status() == STATUS_UPLOADED)
+    body, extra_args = s3.objects[S3_KEY]
+    assert body == b"%PDF-1.7 body"
+    assert extra_args == {"Metadata": {"id": FILE_ID}, "ContentType": "application/pdf",
+                          "ContentEncoding": "zstd"}
+    wait_for(lambda: upload_queue.metrics().uploaded == 1)
+    assert staged_files(staging) == []
+    assert stat_statuses() == {STATUS_PENDING: 0, STATUS_UPLOADED: 1}
+
+
+def test_uploads_owned_by_a_live_process_are_left_alone(queues, staging):
+    owner = UploadQueue()
+    owner.staging_dir = staging
+    os.makedirs(staging)
+    owner.stage(io.BytesIO(b"body"), FILE_ID, S3_KEY, "application/pdf")
+    add_pending_row()
+
+    s3 = FakeS3()
+    other = start(queues, s3, staging)
+    other.rescan()
+    assert other.metrics().depth == 0 and s3.calls == 0
+
+    owner.discard(FILE_ID)  # owner finishes with it: files and flock are gone
+    assert staged_files(staging) == []
+
+
+def test_retries_then_gives_up(queues, staging):
+    crashed_request(staging)
+    s3 = FakeS3(failures=2)
+    upload_queue = start(queues, s3, staging, max_retries=1)
+
+    wait_for(lambda: status() == STATUS_FAILED)
+    wait_for(lambda: upload_queue.metrics().failed == 1)
+    metrics = upload_queue.metrics()
+    assert (s3.calls, metrics.retried, metrics.depth) == (2, 1, 0)
+    assert staged_files(staging) == []
+    assert sorted(os.listdir(os.path.join(staging, "failed"))) == [f"{FILE_ID}.body", f"{FILE_ID}.json"]
+    assert stat_statuses() == {STATUS_PENDING: 0, STATUS_FAILED: 1}
+
+
+def test_upload_waits_for_the_row_to_be_committed(queues, staging):
+    crashed_request(staging, insert_row=False)
+    s3 = FakeS3()
+    start(queues, s3, staging)
+    time.sleep(0.1)
+    assert s3.calls == 0  # no row yet: requeued, not uploaded
+
+    add_pending_row()
+    wait_for(lambda: status() == STATUS_UPLOADED)
+    assert S3_KEY in s3.objects
+
+
+def test_orphan_is_dropped_after_the_grace_period(queues, staging):
+    crashed_request(staging, insert_row=False)
+    s3 = FakeS3()
+    upload_queue = start(queues, s3, staging, orphan_grace=0)
+
+    wait_for(lambda: staged_files(staging) == [])
+    assert s3.calls == 0 and upload_queue.metrics().depth == 0
@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from models import SearchRequest
+from vector_index import HashingEmbedder, VectorIndex, chunk_text, make_embedder
+
+SOLAR = "solar capacity additions in 2030 and photovoltaic module prices"
+CARBON = "carbon tax revenue recycled as household dividends"
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = VectorIndex()
+    index.open(str(tmp_path), HashingEmbedder(64))
+    return index
+
+
+def top_ids(index, query, k=5):
+    return [hit["upload_id"] for hit in index.search([query], k=k)[0]]
+
+
+def test_hashing_embedder_is_deterministic_and_normalised():
+    a = HashingEmbedder(128).embed([SOLAR, CARBON, ""])
+    b = HashingEmbedder(128).embed([SOLAR, CARBON, ""])
+    assert a.dtype == np.float32 and a.shape == (3, 128)
+    assert np.array_equal(a, b)
+    assert np.allclose(np.linalg.norm(a[:2], axis=1), 1.0)
+    assert not a[2].any()  # no tokens, no features
+
+
+def test_hashing_embedder_ignores_case_and_punctuation():
+    embedder = HashingEmbedder(128)
+    a, b = embedder.embed(["Carbon tax, revenue!", "carbon TAX revenue"])
+    assert np.allclose(a, b)
+
+
+def test_make_embedder():
+    assert make_embedder("hashing").dim == 384
+    assert make_embedder("hashing:512").name == "hashing-512"
+    with pytest.raises(ValueError):
+        make_embedder("word2vec")
+
+
+def test_chunk_text_overlaps_and_keeps_every_word():
+    words = [f"w{i}" for i in range(500)]
+    chunks = chunk_text(" ".join(words), size=100, overlap=20)
+    assert len(chunks) > 1
+    assert chunks[0].split()[0] == "w0" and chunks[-1].split()[-1] == "w499"
+    assert chunks[1].split()[0] in chunks[0].split()  # starts inside the previous chunk
+    assert chunk_text("") == []
+
+
+def test_search_ranks_matching_document_first(index):
+    index.add("a" * 32, [SOLAR])
+    index.add("b" * 32, [CARBON])
+    results = index.search(["solar capacity 2030", "carbon tax revenue"], k=2)
+    assert [hits[0]["upload_id"] for hits in results] == ["a" * 32, "b" * 32]
+    assert results[0][0]["text"] == SOLAR and results[0][0]["chunk"] == 0
+    assert results[0][0]["score"] > results[0][1]["score"]
+
+
+def test_search_empty_index(index):
+    assert index.search(["anything"], k=3) == [[]]
+
+
+def test_add_replaces_previous_rows(index):
+    index.add("a" * 32, [SOLAR, CARBON])
+    index.add("a" * 32, [CARBON])
+    assert index.stats()["live_rows"] == 1
+    assert [hit["text"] for hit in index.search(["solar"], k=5)[0]] == [CARBON]
+
+
+def test_delete_tombstones_and_compact_drops_rows(index):
+    index.add("a" * 32, [SOLAR])
+    index.add("b" * 32, [CARBON, SOLAR])
+    index.delete("b" * 32)
+    assert top_ids(index, "solar") == ["a" * 32]
+    assert index.stats() == {"rows": 3, "live_rows": 1, "dim": 64, "embedder": "hashing-64"}
+
+    assert index.compact(min_deleted=0.9) is False  # only 2 of 3 rows deleted
+    assert index.compact(min_deleted=0.5) is True
+    assert index.stats()["rows"] == 1
+    assert top_ids(index, "solar") == ["a" * 32]
+    assert index.compact() is False  # nothing left to drop
+
+    index.add("c" * 32, [CARBON])  # appends after a compaction line up again
+    assert top_ids(index, "carbon tax", k=1) == ["c" * 32]
+
+
+def test_add_skips_documents_deleted_meanwhile(index):
+    index.add("a" * 32, [SOLAR])
+    index.add("a" * 32, [CARBON], exists=lambda: False)
+    assert index.stats()["live_rows"] == 0
+    index.add("b" * 32, [CARBON], exists=lambda: True)
+    assert top_ids(index, "carbon") == ["b" * 32]
+
+
+def test_reopen_with_other_embedder_fails(index, tmp_path):
+    index.add("a" * 32, [SOLAR])
+    with pytest.raises(ValueError):
+        VectorIndex().open(str(tmp_path), HashingEmbedder(32))
+    reopened = VectorIndex()
+    reopened.open(str(tmp_path), HashingEmbedder(64))
+    assert top_ids(reopened, "solar") == ["a" * 32]
+
+
+def test_import_does_not_load_numpy():
+    check = "import sys, vector_index, deletion; assert 'numpy' not in sys.modules"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", check], check=True, cwd=root)
+
+
+@pytest.mark.parametrize("body", [
+    {"queries": []},
+    {"queries": ["q"] * 65},
+    {"queries": ["q"], "k": 0},
+    {"queries": ["q"], "k": 101},
+])
+def test_search_request_bounds(body):
+    with pytest.raises(ValidationError):
+        SearchRequest(**body)
+    assert SearchRequest(queries=["q"] * 64, k=100).k == 100
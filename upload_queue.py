@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import queue
+import fcntl
+import shutil
+import logging
+import threading
+from typing import BinaryIO, Optional
+
+import stats
+from db import db_manager
+from processing import processor
+from models import Upload, UploadQueueMetrics, STATUS_UPLOADED, STATUS_FAILED
+
+logger = logging.getLogger(__name__)
+
+# Staging area layout (one pair of files per upload, named by Upload.id):
+#   <staging_dir>/<id>.body   request body, written before the DB row is committed
+#   <staging_dir>/<id>.json   manifest: s3_key, content_type, content_encoding, staged_at
+#   <staging_dir>/failed/     uploads that ran out of retries, kept for inspection
+# A process owns an upload while it holds an flock on its manifest, so several
+# uvicorn workers can share one staging dir and a crashed worker's uploads are
+# picked up again by the next rescan (or the next start).
+BODY_SUFFIX = ".body"
+MANIFEST_SUFFIX = ".json"
+TMP_SUFFIX = ".part"
+
+
+class UploadQueue:
+    """Durable local staging area drained to S3 by a bounded pool of worker threads"""
+
+    def __init__(self):
+        self.enabled = False
+        self.staging_dir: Optional[str] = None
+        self._s3 = None
+        self._bucket: Optional[str] = None
+        self._workers: list[threading.Thread] = []
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._locks: dict[str, int] = {}  # upload id -> fd holding the manifest flock
+        self._staged: dict[str, float] = {}  # upload id -> staged_at, for depth/lag
+        self._in_flight = 0
+        self._uploaded = 0
+        self._retried = 0
+        self._failed = 0
+
+    def start(self, s3_client, bucket: str, staging_dir: str, workers: int = 4,
+              max_retries: int = 5, rescan_interval: float = 60.0, orphan_grace: float = 300.0):
+        self._s3 = s3_client
+        self._bucket = bucket
+        self.staging_dir = staging_dir
+        self.max_retries = max_retries
+        self.rescan_interval = rescan_interval
+        self.orphan_grace = orphan_grace
+        os.makedirs(os.path.join(staging_dir, "failed"), exist_ok=True)
+        self._stop.clear()
+
+        self.rescan()  # recover uploads staged before the last shutdown/crash
+
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"upload-queue-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+        janitor = threading.Thread(target=self._janitor, name="upload-queue-janitor", daemon=True)
+        janitor.start()
+        self._workers.append(janitor)
+        self.enabled = True
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the workers; anything not yet in S3 stays staged for the next start"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        for _ in self._workers:
+            self._queue.put(None)
+        for t in self._workers:
+            t.join(timeout)
+        self._workers = []
+        with self._lock:
+            for file_id in list(self._locks):
+                self._release(file_id)
+            self._staged.clear()
+
+    # ====== Request side ======
+    def stage(self, fileobj: BinaryIO, file_id: str, s3_key: str, content_type: str,
+              content_encoding: Optional[str] = None):
+        """Write the request body and its manifest to the staging area and claim them"""
+        body_path = self._path(file_id, BODY_SUFFIX)
+        tmp_path = body_path + TMP_SUFFIX
+        with open(tmp_path, "wb") as out:
+            shutil.copyfileobj(fileobj, out, 1024 * 1024)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, body_path)
+
+        staged_at = time.time()
+        manifest_path = self._path(file_id, MANIFEST_SUFFIX)
+        with open(manifest_path + TMP_SUFFIX, "w") as out:
+            json.dump({"s3_key": s3_key, "content_type": content_type,
+                       "content_encoding": content_encoding, "staged_at": staged_at}, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(manifest_path + TMP_SUFFIX, manifest_path)
+
+        with self._lock:
+            self._claim(file_id)
+            self._staged[file_id] = staged_at
+
+    def enqueue(self, file_id: str):
+        """Hand a staged upload to the workers, once its Upload row is committed"""
+        self._queue.put(file_id)
+
+    def discard(self, file_id: str):
+        """Drop a staged upload (DB insert failed, or the file was deleted while pending)"""
+        with self._lock:
+            self._remove(file_id)
+
+    # ====== Worker side ======
+    def rescan(self):
+        """Queue every staged upload that no live process currently owns"""
+        try:
+            names = sorted(os.listdir(self.staging_dir))
+        except FileNotFoundError:
+            return
+        recovered = []
+        for name in names:
+            if not name.endswith(MANIFEST_SUFFIX):
+                continue
+            file_id = name[:-len(MANIFEST_SUFFIX)]
+            with self._lock:
+                if file_id in self._locks or not self._claim(file_id):
+                    continue
+                manifest = self._read_manifest(file_id)
+                if manifest is None:
+                    self._release(file_id)
+                    continue
+                self._staged[file_id] = manifest["staged_at"]
+            recovered.append((manifest["staged_at"], file_id))
+        for _, file_id in sorted(recovered):
+            self._queue.put(file_id)
+        if recovered:
+            logger.info("upload queue: recovered %d staged uploads", len(recovered))
+
+    def metrics(self) -> UploadQueueMetrics:
+        with self._lock:
+            oldest = min(self._staged.values(), default=None)
+            return UploadQueueMetrics(
+                enabled=self.enabled,
+                workers=max(len(self._workers) - 1, 0),
+                depth=len(self._staged),
+                in_flight=self._in_flight,
+                lag_seconds=round(time.time() - oldest, 3) if oldest else 0.0,
+                uploaded=self._uploaded,
+                retried=self._retried,
+                failed=self._failed,
+            )
+
+    def _worker(self):
+        while True:
+            file_id = self._queue.get()
+            if file_id is None or self._stop.is_set():
+                return
+            with self._lock:
+                if file_id not in self._locks:
+                    continue  # discarded while waiting
+                self._in_flight += 1
+            try:
+                self._process(file_id)
+            except Exception:
+                logger.exception("upload queue: unexpected error for %s", file_id)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+    def _janitor(self):
+        while not self._stop.wait(self.rescan_interval):
+            self.rescan()
+
+    def _process(self, file_id: str):
+        manifest = self._read_manifest(file_id)
+        if manifest is None:
+            self.discard(file_id)
+            return
+
+        with db_manager.get_session() as session:
+            if session.get(Upload, file_id) is None:
+                # Row never committed (request failed after staging) or file deleted while pending
+                if time.time() - manifest["staged_at"] > self.orphan_grace:
+                    logger.info("upload queue: dropping orphaned staged upload %s", file_id)
+                    self.discard(file_id)
+                elif not self._stop.wait(1.0):
+                    self._queue.put(file_id)  # commit may still be in flight; look again shortly
+                return
+
+        extra_args = {
+            'Metadata': {
+                'id': file_id,
+            },
+            'ContentType': manifest["content_type"]
+        }
+        if manifest.get("content_encoding"):
+            extra_args['ContentEncoding'] = manifest["content_encoding"]
+
+        # PHASE 1: push the staged body to S3, retrying with exponential backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._s3.upload_file(
+                    self._path(file_id, BODY_SUFFIX),
+                    self._bucket,
+                    manifest["s3_key"],
+                    ExtraArgs=extra_args
+                )
+                break
+            except Exception as s3_error:
+                if file_id not in self._locks:
+                    return  # discarded (deleted while pending) mid-transfer
+                if attempt == self.max_retries:
+                    self._give_up(file_id, s3_error)
+                    return
+                with self._lock:
+                    self._retried += 1
+                logger.warning("upload queue: S3 upload of %s failed (attempt %d): %s", file_id, attempt + 1, s3_error)
+                if self._stop.wait(min(2 ** attempt, 60)):
+                    return  # shutting down; stays staged for the next start
+
+        # PHASE 2: flip the row to uploaded, or clean up if it was deleted meanwhile
+        with db_manager.get_session() as session:
+            upload = session.get(Upload, file_id)
+            if upload is None:
+                self._s3.delete_object(Bucket=self._bucket, Key=manifest["s3_key"])
+            else:
+                old_status, upload.status = upload.status, STATUS_UPLOADED
+                session.add(upload)
+                stats.move(session, upload, old_status)
+                session.commit()
+                processor.submit(file_id)
+
+        with self._lock:
+            self._uploaded += 1
+            self._remove(file_id)
+
+    def _give_up(self, file_id: str, error: Exception):
+        logger.error("upload queue: giving up on %s: %s", file_id, error)
+        with db_manager.get_session() as session:
+            upload = session.get(Upload, file_id)
+            if upload is not None:
+                old_status, upload.status = upload.status, STATUS_FAILED
+                session.add(upload)
+                stats.move(session, upload, old_status)
+                session.commit()
+        with self._lock:
+            self._failed += 1
+            failed_dir = os.path.join(self.staging_dir, "failed")
+            for suffix in (BODY_SUFFIX, MANIFEST_SUFFIX):
+                try:
+                    os.replace(self._path(file_id, suffix), os.path.join(failed_dir, file_id + suffix))
+                except FileNotFoundError:
+                    pass
+            self._release(file_id)
+            self._staged.pop(file_id, None)
+
+    # ====== Staging files (call with self._lock held) ======
+    def _path(self, file_id: str, suffix: str) -> str:
+        return os.path.join(self.staging_dir, file_id + suffix)
+
+    def _read_manifest(self, file_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(file_id, MANIFEST_SUFFIX)) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(self._path(file_id, BODY_SUFFIX)):
+            return None
+        return manifest
+
+    def _claim(self, file_id: str) -> bool:
+        try:
+            fd = os.open(self._path(file_id, MANIFEST_SUFFIX), os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._locks[file_id] = fd
+        return True
+
+    def _release(self, file_id: str):
+        fd = self._locks.pop(file_id, None)
+        if fd is not None:
+            os.close(fd)  # closing drops the flock
+
+    def _remove(self, file_id: str):
+        for suffix in (BODY_SUFFIX, MANIFEST_SUFFIX):
+            try:
+                os.remove(self._path(file_id, suffix))
+            except FileNotFoundError:
+                pass
+        self._release(file_id)
+        self._staged.pop(file_id, None)
+
+
+# Global instance
+upload_queue = UploadQueue()
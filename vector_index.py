@@ -0,0 +1,393 @@
+import os
+import re
+import json
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+import logging
+from typing import Callable, Optional
+
+from db import db_manager
+from models import Upload
+
+logger = logging.getLogger(__name__)
+
+# On-disk layout (all row-aligned; row i of every file describes chunk i):
+#   vectors.f32   N x dim float32, L2-normalised, so cosine similarity is a dot product
+#   ids.S32       N upload ids (uuid hex, 32 bytes)
+#   deleted.u8    N tombstone flags, set when the upload is deleted or re-indexed
+#   offsets.i64   N byte offsets of the chunk's JSON line in chunks.jsonl
+#   chunks.jsonl  {"upload_id", "chunk", "text"} per row
+#   meta.json     {"dim", "embedder"}
+# Writers take an flock on `lock` and append vectors.f32 last, so readers (other worker
+# processes included) treat the row count implied by vectors.f32 as committed. compact()
+# swaps the files in place; searches hold a shared flock on `swap.lock` so that never
+# happens halfway through one.
+# NumPy is imported where it is used, so workers without an index don't pay for it at startup
+ID_DTYPE = "S32"
+ID_SIZE = 32
+SEARCH_BLOCK = 65536  # rows scored per matrix multiply
+
+
+# ====== Embedders ======
+class HashingEmbedder:
+    """Deterministic feature-hashing embedder (word unigrams + bigrams). No model download,
+    stable across processes; good enough for keyword-ish retrieval and for tests."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: list[str]):
+        import numpy as np
+
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = re.findall(r"\w+", text.lower())
+            for feature in tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]:
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                out[row, value % self.dim] += 1.0 if value >> 63 else -1.0
+        return _normalize(out)
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model, e.g. "all-MiniLM-L6-v2" (optional dependency)"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name}"
+
+    def embed(self, texts: list[str]):
+        import numpy as np
+
+        vectors = self.model.encode(texts, batch_size=64, convert_to_numpy=True)
+        return _normalize(vectors.astype(np.float32))
+
+
+def make_embedder(spec: str):
+    """"hashing", "hashing:512" or "st:<sentence-transformers model>" """
+    kind, _, arg = spec.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(int(arg) if arg else 384)
+    if kind == "st":
+        return SentenceTransformerEmbedder(arg)
+    raise ValueError(f"Unknown embedder: {spec}")
+
+
+def _normalize(vectors):
+    import numpy as np
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# ====== Text extraction & chunking ======
+def extract_text(upload: Upload, local_path: str) -> str:
+    if upload.file_type == "pdf":
+        import pypdfium2 as pdfium
+
+        pdf = pdfium.PdfDocument(local_path)
+        try:
+            return "\n".join(page.get_textpage().get_text_range() for page in pdf)
+        finally:
+            pdf.close()
+    if upload.file_type in ("xls", "xlsx"):
+        import pandas as pd
+
+        lines = []
+        for name, df in pd.read_excel(local_path, sheet_name=None).items():
+            lines.append(f"Sheet: {name}")
+            for record in df.astype(str).to_dict("records"):
+                lines.append("; ".join(f"{k}: {v}" for k, v in record.items() if v != "nan"))
+        return "\n".join(lines)
+    return ""
+
+
+def chunk_text(text: str, size: int = 800, overlap: int = 100) -> list[str]:
+    """~size-character chunks on word boundaries, overlapping so sentences aren't cut off"""
+    chunks, current, length, fresh = [], [], 0, 0
+    for word in text.split():
+        current.append(word)
+        length += len(word) + 1
+        fresh += 1
+        if length >= size:
+            chunks.append(" ".join(current))
+            # carry the tail over as overlap
+            tail, tail_length = [], 0
+            for w in reversed(current):
+                if tail_length + len(w) + 1 > overlap:
+                    break
+                tail.insert(0, w)
+                tail_length += len(w) + 1
+            current, length, fresh = tail, tail_length, 0
+    if fresh:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+# ====== Index ======
+class VectorIndex:
+    """Append-only chunk/embedding store over memory-mapped NumPy arrays with tombstones"""
+
+    def __init__(self):
+        self.enabled = False
+        self.directory: Optional[str] = None
+        self.embedder = None
+        self.dim = 0
+        self._lock = threading.Lock()
+        self._maps: dict[str, tuple] = {}  # file -> ((inode, size), memmap)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def open(self, directory: str, embedder):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.embedder = embedder
+        self.dim = embedder.dim
+        meta_path = self._path("meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["dim"] != self.dim or meta["embedder"] != embedder.name:
+                raise ValueError(f"Index in {directory} was built with {meta['embedder']}; "
+                                 f"rebuild it or configure the same embedder")
+        else:
+            with open(meta_path, "w") as f:
+                json.dump({"dim": self.dim, "embedder": embedder.name}, f)
+        self.enabled = True
+
+    # ====== Writes ======
+    def add(self, upload_id: str, texts: list[str], exists: Optional[Callable[[], bool]] = None):
+        """Index a document's chunks, replacing any rows it already had.
+
+        `exists` is checked under the write lock: a delete() that ran while the chunks were
+        being embedded already tombstoned the document, so its rows must not be appended.
+        """
+        import numpy as np
+
+        vectors = self.embedder.embed(texts) if texts else np.zeros((0, self.dim), np.float32)
+        with self._write_lock():
+            self._repair()
+            self._tombstone(upload_id)
+            if not texts or (exists is not None and not exists()):
+                return
+            with open(self._path("chunks.jsonl"), "ab") as f:
+                offsets = []
+                for number, text in enumerate(texts):
+                    offsets.append(f.tell())
+                    line = {"upload_id": upload_id, "chunk": number, "text": text}
+                    f.write(json.dumps(line, ensure_ascii=False).encode() + b"\n")
+            self._append("offsets.i64", np.asarray(offsets, dtype=np.int64))
+            self._append("ids.S32", np.full(len(texts), upload_id, dtype=ID_DTYPE))
+            self._append("deleted.u8", np.zeros(len(texts), dtype=np.uint8))
+            self._append("vectors.f32", vectors.astype(np.float32))  # last: commits the rows
+
+    def delete(self, upload_id: str):
+        with self._write_lock():
+            self._tombstone(upload_id)
+
+    def compact(self, min_deleted: float = 0.0) -> bool:
+        """Rewrite the index without tombstoned rows, if at least `min_deleted` of them are
+        tombstoned; returns whether it did"""
+        import numpy as np
+
+        with self._write_lock():
+            self._repair()
+            count = self._count()
+            if count == 0:
+                return False
+            deleted = int(self._map("deleted.u8", np.uint8, count).sum())
+            if deleted == 0 or deleted < min_deleted * count:
+                return False
+            live = np.flatnonzero(self._map("deleted.u8", np.uint8, count) == 0)
+            vectors = np.asarray(self._map("vectors.f32", np.float32, count, self.dim)[live])
+            ids = np.asarray(self._map("ids.S32", ID_DTYPE, count)[live])
+            offsets = self._map("offsets.i64", np.int64, count)[live]
+
+            new_offsets = []
+            with open(self._path("chunks.jsonl"), "rb") as src, open(self._path("chunks.jsonl.tmp"), "wb") as dst:
+                for offset in offsets:
+                    src.seek(int(offset))
+                    new_offsets.append(dst.tell())
+                    dst.write(src.readline())
+            for name, array in (("vectors.f32", vectors), ("ids.S32", ids),
+                                ("offsets.i64", np.asarray(new_offsets, dtype=np.int64)),
+                                ("deleted.u8", np.zeros(len(live), dtype=np.uint8))):
+                array.tofile(self._path(name + ".tmp"))
+            # vectors last again so a crash mid-way never exposes more rows than the other files hold
+            with self._file_lock("swap.lock", fcntl.LOCK_EX):
+                for name in ("chunks.jsonl", "ids.S32", "offsets.i64", "deleted.u8", "vectors.f32"):
+                    os.replace(self._path(name + ".tmp"), self._path(name))
+                with self._lock:
+                    self._maps.clear()
+            logger.info("vector index: compacted %d rows to %d", count, len(live))
+            return True
+
+    def start_compactor(self, interval: float = 86400.0, min_deleted: float = 0.2):
+        """Compact every `interval` seconds once `min_deleted` of the rows are tombstoned
+        (run it from one process per index directory)"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run_compactor, args=(interval, min_deleted),
+                                        name="vector-compact", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run_compactor(self, interval: float, min_deleted: float):
+        while not self._stop.wait(interval):
+            try:
+                self.compact(min_deleted)
+            except Exception:
+                logger.exception("vector index: compaction failed")
+
+    # ====== Reads ======
+    def search(self, queries: list[str], k: int = 5) -> list[list[dict]]:
+        """Top-k cosine matches for a batch of queries, scored block by block"""
+        with self._file_lock("swap.lock", fcntl.LOCK_SH):
+            return self._search(queries, k)
+
+    def _search(self, queries: list[str], k: int) -> list[list[dict]]:
+        import numpy as np
+
+        count = self._count()
+        if count == 0 or not queries:
+            return [[] for _ in queries]
+        q = self.embedder.embed(queries).T  # dim x B
+        vectors = self._map("vectors.f32", np.float32, count, self.dim)
+        deleted = self._map("deleted.u8", np.uint8, count)
+        k = min(k, count)
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, count, SEARCH_BLOCK):
+            stop = min(start + SEARCH_BLOCK, count)
+            scores = (vectors[start:stop] @ q).T  # B x block
+            scores[:, deleted[start:stop] != 0] = -np.inf
+            take = min(k, stop - start)
+            top = np.argpartition(scores, -take, axis=1)[:, -take:]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_rows = np.concatenate([best_rows, top + start], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(best_scores, -k, axis=1)[:, -k:]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+
+        offsets = self._map("offsets.i64", np.int64, count)
+        results = []
+        with open(self._path("chunks.jsonl"), "rb") as chunks:
+            for scores, rows in zip(best_scores, best_rows):
+                hits = []
+                for score, row in zip(scores, rows):
+                    if not np.isfinite(score):
+                        continue  # fewer live rows than k
+                    chunks.seek(int(offsets[row]))
+                    hit = json.loads(chunks.readline())
+                    hit["score"] = round(float(score), 6)
+                    hits.append(hit)
+                results.append(hits)
+        return results
+
+    def stats(self) -> dict:
+        count = self._count()
+        deleted = int(self._map("deleted.u8", "u1", count).sum()) if count else 0
+        return {"rows": count, "live_rows": count - deleted, "dim": self.dim,
+                "embedder": self.embedder.name if self.embedder else None}
+
+    # ====== Files ======
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _count(self) -> int:
+        try:
+            return os.path.getsize(self._path("vectors.f32")) // (4 * self.dim)
+        except FileNotFoundError:
+            return 0
+
+    def _map(self, name: str, dtype, count: int, dim: Optional[int] = None):
+        """Read-only memmap of the first `count` rows, re-mapped only when the file grew"""
+        import numpy as np
+
+        path = self._path(name)
+        st = os.stat(path)
+        version = (st.st_ino, st.st_size)  # inode changes when compact() swaps the file
+        with self._lock:
+            cached = self._maps.get(name)
+            if cached is None or cached[0] != version:
+                cached = (version, np.memmap(path, dtype=dtype, mode="r"))
+                self._maps[name] = cached
+        array = cached[1]
+        if dim is not None:
+            array = array[:count * dim].reshape(count, dim)
+        return array[:count]
+
+    def _repair(self):
+        """Drop rows a crashed writer appended to the side files but never committed"""
+        count = self._count()
+        for name, itemsize in (("vectors.f32", 4 * self.dim), ("offsets.i64", 8),
+                               ("ids.S32", ID_SIZE), ("deleted.u8", 1)):
+            path = self._path(name)
+            if os.path.exists(path) and os.path.getsize(path) > count * itemsize:
+                os.truncate(path, count * itemsize)
+
+    def _append(self, name: str, array):
+        with open(self._path(name), "ab") as f:
+            f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _tombstone(self, upload_id: str):
+        import numpy as np
+
+        count = self._count()
+        if count == 0:
+            return
+        ids = self._map("ids.S32", ID_DTYPE, count)
+        rows = np.flatnonzero(ids == upload_id.encode())
+        if len(rows) == 0:
+            return
+        flags = np.memmap(self._path("deleted.u8"), dtype=np.uint8, mode="r+")
+        flags[rows] = 1
+        flags.flush()
+        del flags
+
+    def _write_lock(self):
+        return self._file_lock("lock", fcntl.LOCK_EX)  # serialises writers across worker processes
+
+    @contextmanager
+    def _file_lock(self, name: str, mode: int):
+        with open(self._path(name), "a") as lock:
+            fcntl.flock(lock, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# Global instance
+vector_index = VectorIndex()
+
+
+def index_document(s3_client, bucket: str, upload: Upload, local_path: str):
+    """Processing handler: chunk, embed and index a document"""
+    if not vector_index.enabled:
+        return
+
+    def exists() -> bool:
+        with db_manager.get_session() as session:
+            return session.get(Upload, upload.id) is not None
+
+    vector_index.add(upload.id, chunk_text(extract_text(upload, local_path)), exists=exists)